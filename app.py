@@ -1,9 +1,31 @@
+import functools
+import hashlib
+import io
+import json
+import logging
+import mimetypes
 import os
+import posixpath
+import queue
+import random
+import re
 import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from flask import (
     Flask,
-    render_template_string,
+    Response,
+    abort,
+    g,
+    get_flashed_messages,
+    has_request_context,
+    jsonify,
+    make_response,
+    render_template,
     request,
     redirect,
     session,
@@ -11,26 +33,811 @@ from flask import (
     url_for,
     send_from_directory,
 )
+import click
+from jinja2 import BaseLoader, ChoiceLoader, FileSystemBytecodeCache, TemplateNotFound
+from markupsafe import Markup, escape
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # no resized variants; pages use the original uploads
+    Image = ImageOps = None
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.pool
+except ImportError:  # only needed with DB_ENGINE=postgres
+    psycopg2 = None
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess as prometheus_multiprocess
+except ImportError:  # no /metrics
+    prometheus_client = None
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "database.db")
+# Storage engine: "sqlite" keeps everything in the DATABASE_PATH file,
+# "postgres" connects to DATABASE_URL through a psycopg2 connection pool
+DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite")
+DB_PATH = os.environ.get("DATABASE_PATH", os.path.join(BASE_DIR, "database.db"))
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
 
-UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
+UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER", os.path.join(BASE_DIR, "uploads"))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app = Flask(__name__)
 app.secret_key = "iceplantsecret_123"
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+# Largest request body accepted (uploads included); bigger ones get a 413
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("UPLOAD_MAX_BYTES", 10 * 1024 * 1024))
+
+# How /uploads is served: "app" streams the file from Python, "x-accel"
+# hands it to nginx via X-Accel-Redirect (an internal location mapped to
+# UPLOAD_ACCEL_PREFIX), "x-sendfile" hands it to Apache/lighttpd.
+UPLOAD_SERVE_MODE = os.environ.get("UPLOAD_SERVE_MODE", "app")
+UPLOAD_ACCEL_PREFIX = os.environ.get("UPLOAD_ACCEL_PREFIX", "/_uploads/")
+app.config["USE_X_SENDFILE"] = UPLOAD_SERVE_MODE == "x-sendfile"
+
+# Cache lifetime for URLs whose content can never change (hashed names)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Width-bounded copies made of every uploaded image (name -> max width px),
+# written as WebP by a background thread pool. Needs Pillow.
+IMAGE_VARIANTS = {"thumb": 160, "card": 480, "full": 1280}
+IMAGE_VARIANT_FORMAT = ("WEBP", ".webp")
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+IMAGE_PIPELINE = Image is not None and os.environ.get("IMAGE_PIPELINE", "1") != "0"
+
+# Connection pool sizing (per gunicorn worker process). SQLite opens extra
+# connections past DB_POOL_SIZE when busy; PostgreSQL never holds more than
+# PG_POOL_MAX, and a request finding them all in use waits up to
+# PG_POOL_TIMEOUT seconds for one to come back.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+PG_POOL_MAX = int(os.environ.get("PG_POOL_MAX", "32"))
+PG_POOL_TIMEOUT = float(os.environ.get("PG_POOL_TIMEOUT", "30"))
+DB_STATEMENT_CACHE = int(os.environ.get("DB_STATEMENT_CACHE", "256"))
+
+# In-process cache of user rows (entries, seconds)
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+
+# PRAGMAs applied to every connection, by profile. "performance" lets
+# readers and writers from different gunicorn workers run concurrently;
+# "default" keeps SQLite's stock rollback journal.
+DB_PROFILES = {
+    "default": {},
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64 * 1024,  # negative = KiB, so 64 MiB
+        "temp_store": "MEMORY",
+    },
+}
+DB_PROFILE = os.environ.get("DB_PROFILE", "performance")
+
+# Retries for statements that still hit SQLITE_BUSY after busy_timeout
+DB_BUSY_RETRIES = int(os.environ.get("DB_BUSY_RETRIES", "5"))
+DB_BUSY_BACKOFF = float(os.environ.get("DB_BUSY_BACKOFF", "0.05"))
+
+# Compiled templates kept per worker, and an optional directory where
+# Jinja bytecode is shared between workers and restarts
+TEMPLATE_CACHE_SIZE = int(os.environ.get("TEMPLATE_CACHE_SIZE", "100"))
+TEMPLATE_BYTECODE_DIR = os.environ.get("TEMPLATE_BYTECODE_DIR", "")
+
+# How often (seconds) a worker re-reads table_versions for ETags and cached
+# fragments; commits made by the worker itself are seen at once
+FRAGMENT_RECHECK = float(os.environ.get("FRAGMENT_RECHECK", "1.0"))
+
+# Live message delivery (/messages/stream). "local" fans out only messages
+# sent through this worker; "sqlite" has each worker poll the messages table
+# so clients on any gunicorn worker hear about every message.
+MESSAGE_HUB = os.environ.get("MESSAGE_HUB", "local")
+MESSAGE_POLL_INTERVAL = float(os.environ.get("MESSAGE_POLL_INTERVAL", "1.0"))
+# Keep-alive comment interval and lifetime (seconds) of one event stream;
+# browsers reconnect on their own when a stream ends
+SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", "15"))
+SSE_MAX_STREAM = float(os.environ.get("SSE_MAX_STREAM", "300"))
+# Open streams allowed per worker; each holds a thread under gthread, so
+# gunicorn.conf.py sizes this to the worker class. Clients over the cap get
+# a 503 and retry after SSE_BUSY_RETRY seconds.
+SSE_MAX_CLIENTS = int(os.environ.get("SSE_MAX_CLIENTS", "4"))
+SSE_BUSY_RETRY = int(os.environ.get("SSE_BUSY_RETRY", "30"))
+
+# Home feed: new posts/ice cans are pushed into followers' timelines in
+# batches, unless the author has more followers than the limit, in which
+# case followers pull them when reading their feed
+TIMELINE_FANOUT_LIMIT = int(os.environ.get("TIMELINE_FANOUT_LIMIT", "5000"))
+TIMELINE_FANOUT_BATCH = int(os.environ.get("TIMELINE_FANOUT_BATCH", "500"))
+
+# Per-request SQL accounting. Every response gets X-SQL-Count and a
+# Server-Timing "db" entry; statements slower than SQL_SLOW_MS go to the
+# slow log (SQL_SLOW_LOG file, or the app log) with their query plan, and a
+# statement run more than SQL_REPEAT_WARN times in one request is warned
+# about. SQL_DEBUG_FOOTER=1 appends the slowest statements to HTML pages.
+SQL_STATS = os.environ.get("SQL_STATS", "1") != "0"
+SQL_SLOW_MS = float(os.environ.get("SQL_SLOW_MS", "100"))
+SQL_SLOW_LOG = os.environ.get("SQL_SLOW_LOG", "")
+SQL_REPEAT_WARN = int(os.environ.get("SQL_REPEAT_WARN", "10"))
+SQL_DEBUG_FOOTER = os.environ.get("SQL_DEBUG_FOOTER", "0") == "1"
+SQL_FOOTER_TOP = 5
+
+# Prometheus metrics at /metrics (needs prometheus_client). Under gunicorn,
+# PROMETHEUS_MULTIPROC_DIR (set by gunicorn.conf.py) is where each worker
+# writes its samples so a scrape of any worker sees the totals. With
+# METRICS_TOKEN set, scrapes must send "Authorization: Bearer <token>".
+METRICS = prometheus_client is not None and os.environ.get("METRICS", "1") != "0"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Mixed into every ETag so a deploy (new templates) invalidates old ones;
+# ASSET_DIGEST does the same for a rebuild of static/dist
+ETAG_SALT = os.environ.get("ETAG_SALT") or str(os.path.getmtime(os.path.abspath(__file__)))
 
 # ---------- DATABASE SETUP ----------
 
+# Errors raised by whichever engine is configured
+if psycopg2 is not None:
+    DatabaseError = (sqlite3.Error, psycopg2.Error)
+    IntegrityError = (sqlite3.IntegrityError, psycopg2.IntegrityError)
+else:
+    DatabaseError = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+
+
+def is_busy_error(exc):
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    msg = str(exc).lower()
+    return "locked" in msg or "busy" in msg
+
+
+def retry_on_busy(fn):
+    """
+    Retries fn with jittered exponential backoff while SQLite reports the
+    database as busy/locked, up to DB_BUSY_RETRIES extra attempts.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        delay = DB_BUSY_BACKOFF
+        for attempt in range(DB_BUSY_RETRIES + 1):
+            try:
+                return fn(*args, **kwargs)
+            except sqlite3.OperationalError as exc:
+                if not is_busy_error(exc) or attempt == DB_BUSY_RETRIES:
+                    raise
+            time.sleep(delay * (0.5 + random.random()))
+            delay = min(delay * 2, 1.0)
+
+    return wrapper
+
+
+def log_query(sql, parameters, seconds):
+    """
+    Records a statement against the current request and returns its entry
+    ([sql, parameters, seconds]) so fetches can add their time to it;
+    executemany() records None as its parameters. Returns None outside a
+    request or with SQL_STATS off.
+    """
+    if not SQL_STATS or not has_request_context():
+        return None
+    entries = g.get("sql_log")
+    if entries is None:
+        entries = g.sql_log = []
+    entry = [sql, parameters, seconds]
+    entries.append(entry)
+    return entry
+
+
+class TimedFetches:
+    """
+    Fetch methods that charge their time to the cursor's last statement;
+    SQLite only steps to the first row in execute(), so most of a query's
+    cost lands here.
+    """
+
+    _entry = None
+
+    def _charge(self, started):
+        if self._entry is not None:
+            self._entry[2] += time.perf_counter() - started
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._charge(started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._charge(started)
+
+
+class RetryingCursor(TimedFetches, sqlite3.Cursor):
+    # Only a statement that starts its own transaction is safe to re-run;
+    # inside an open transaction the caller has to retry the whole unit.
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            if self.connection.in_transaction:
+                return super().execute(sql, parameters)
+            return retry_on_busy(super().execute)(sql, parameters)
+        finally:
+            self._entry = log_query(sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            if self.connection.in_transaction:
+                return super().executemany(sql, seq_of_parameters)
+            return retry_on_busy(super().executemany)(sql, seq_of_parameters)
+        finally:
+            self._entry = log_query(sql, None, time.perf_counter() - started)
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            self._charge(started)
+
+
+class RetryingConnection(sqlite3.Connection):
+    def cursor(self, factory=RetryingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    @retry_on_busy
+    def commit(self):
+        super().commit()
+        version_cache.invalidate()
+
+
+def apply_db_profile(conn, profile=None):
+    pragmas = DB_PROFILES[profile or DB_PROFILE]
+    # A plain cursor, so a connection opened mid-request doesn't log its
+    # PRAGMAs as the request's statements
+    cur = sqlite3.Cursor(conn)
+    for name, value in pragmas.items():
+        retry_on_busy(cur.execute)(f"PRAGMA {name} = {value}")
+    return conn
+
+
+def connect_db(profile=None):
+    """
+    Opens a raw connection to DB_PATH with the configured PRAGMA profile,
+    or to DATABASE_URL with DB_ENGINE=postgres. Routes should use get_db()
+    instead, which hands out a pooled connection bound to the current
+    request.
+    """
+    if DB_ENGINE == "postgres":
+        return PgConnection(psycopg2.connect(DATABASE_URL))
+    conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        cached_statements=DB_STATEMENT_CACHE,
+        factory=RetryingConnection,
+    )
+    return apply_db_profile(conn, profile)
+
+
+class ConnectionPool:
+    """
+    Small thread-safe pool of SQLite connections shared by all threads of
+    one worker process. Connections are health-checked when handed out and
+    rolled back when returned, so a request never sees another request's
+    half-finished transaction.
+    """
+
+    def __init__(self, connect, size):
+        self._connect = connect
+        self._size = size
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            if self._healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        with self._lock:
+            if len(self._idle) < self._size:
+                self._idle.append(conn)
+                return
+        self._discard(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for conn in idle:
+            self._discard(conn)
+
+    @staticmethod
+    def _healthy(conn):
+        # A plain cursor, so the check isn't logged as one of the request's
+        # statements
+        try:
+            sqlite3.Cursor(conn).execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+# Tables with a serial id; an INSERT into one of them reports the new id
+# as cursor.lastrowid on PostgreSQL too
+_SERIAL_TABLES = {"users", "icecans", "messages", "websites", "materials", "posts", "activities"}
+_PG_TOKENS = re.compile(r"'(?:[^']|'')*'|\?|%")
+_PG_INSERT = re.compile(r"\s*INSERT\s+(OR\s+IGNORE\s+)?INTO\s+(\w+)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=DB_STATEMENT_CACHE)
+def pg_statement(sql, with_params):
+    """
+    Rewrites one of the app's SQLite-dialect statements for psycopg2:
+    ? placeholders become %s, INSERT OR IGNORE becomes ON CONFLICT DO
+    NOTHING, and inserts into serial tables get RETURNING id. Returns
+    (sql, returns_id).
+    """
+
+    def token(m):
+        if m.group() == "?":
+            return "%s"
+        # psycopg2 only treats % as special when there are parameters, but
+        # then everywhere, string literals included
+        return m.group().replace("%", "%%") if with_params else m.group()
+
+    sql = _PG_TOKENS.sub(token, sql)
+    insert = _PG_INSERT.match(sql)
+    returns_id = False
+    if insert:
+        if insert.group(1):
+            sql = sql[: insert.start(1)] + sql[insert.end(1):] + " ON CONFLICT DO NOTHING"
+        elif insert.group(2) in _SERIAL_TABLES and "RETURNING" not in sql.upper():
+            sql += " RETURNING id"
+            returns_id = True
+    return sql, returns_id
+
+
+class PgCursorBase:
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection.raw.cursor()
+        self.lastrowid = None
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+
+class PgCursor(TimedFetches, PgCursorBase):
+    """The parts of sqlite3.Cursor the app uses, on a psycopg2 cursor."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            pg_sql, returns_id = pg_statement(sql, bool(parameters))
+            self._cursor.execute(pg_sql, tuple(parameters) or None)
+            if returns_id:
+                self.lastrowid = self._cursor.fetchone()[0]
+        finally:
+            self._entry = log_query(sql, parameters, time.perf_counter() - started)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(pg_statement(sql, True)[0], seq_of_parameters)
+        finally:
+            self._entry = log_query(sql, None, time.perf_counter() - started)
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class PgConnection:
+    """
+    A psycopg2 connection behind the sqlite3.Connection interface the app
+    is written against (execute() on the connection, in_transaction), so
+    the same queries run on either engine.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def cursor(self):
+        return PgCursor(self)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        self.raw.commit()
+        version_cache.invalidate()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    @property
+    def in_transaction(self):
+        status = self.raw.get_transaction_status()
+        return status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.raw.close()
+
+
+class PgPool:
+    """
+    ConnectionPool's interface over psycopg2's ThreadedConnectionPool.
+    ThreadedConnectionPool raises once all `size` connections are out, so a
+    semaphore makes acquire() wait up to `timeout` seconds instead. Like
+    ConnectionPool, connections are health-checked when handed out (a
+    server restart leaves every idle one broken) and rolled back when
+    returned; broken ones are closed and replaced on demand.
+    """
+
+    def __init__(self, dsn, size, timeout):
+        self._pool = psycopg2.pool.ThreadedConnectionPool(1, size, dsn)
+        self._slots = threading.BoundedSemaphore(size)
+        self._timeout = timeout
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise psycopg2.pool.PoolError(
+                f"no PostgreSQL connection free after {self._timeout:g}s"
+            )
+        try:
+            while True:
+                raw = self._pool.getconn()
+                if self._healthy(raw):
+                    return PgConnection(raw)
+                self._pool.putconn(raw, close=True)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        broken = bool(conn.raw.closed)
+        if not broken:
+            try:
+                conn.raw.rollback()
+            except psycopg2.Error:
+                broken = True
+        self._pool.putconn(conn.raw, close=broken)
+        self._slots.release()
+
+    def close_all(self):
+        self._pool.closeall()
+
+    @staticmethod
+    def _healthy(raw):
+        if raw.closed:
+            return False
+        # The raw cursor keeps the check out of the request's SQL log
+        try:
+            with raw.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            raw.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+if DB_ENGINE == "postgres":
+    db_pool = PgPool(DATABASE_URL, PG_POOL_MAX, PG_POOL_TIMEOUT)
+else:
+    db_pool = ConnectionPool(connect_db, DB_POOL_SIZE)
+
+
 def get_db():
-    return sqlite3.connect(DB_PATH)
+    """
+    Returns the connection for the current request, checking one out of the
+    pool on first use. It goes back to the pool when the app context ends.
+    """
+    if "db" not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    db = g.pop("db", None)
+    if db is not None:
+        db_pool.release(db)
+
+
+class VersionCache:
+    """
+    This worker's copy of table_versions. A table's counter is re-read at
+    most every `recheck` seconds, so other workers' writes show up within
+    that window without a query per request; any commit on this worker
+    drops the copy so its own writes show up at once.
+    """
+
+    def __init__(self, recheck):
+        self.recheck = recheck
+        self._versions = {}  # table -> (version, read at)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, tables):
+        now = time.monotonic()
+        versions, stale = {}, []
+        for t in tables:
+            entry = self._versions.get(t)
+            if entry is None or now - entry[1] >= self.recheck:
+                stale.append(t)
+            else:
+                versions[t] = entry[0]
+        if stale:
+            generation = self._generation
+            placeholders = ",".join("?" for _ in stale)
+            rows = get_db().execute(
+                f"SELECT name, version FROM table_versions WHERE name IN ({placeholders})",
+                tuple(stale),
+            ).fetchall()
+            fresh = dict(rows)
+            with self._lock:
+                # A commit since the read began makes what was read stale
+                keep = generation == self._generation
+                for t in stale:
+                    versions[t] = fresh.get(t, 0)
+                    if keep:
+                        self._versions[t] = (versions[t], now)
+        return [versions[t] for t in tables]
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._versions = {}
+
+
+version_cache = VersionCache(FRAGMENT_RECHECK)
+
+
+def table_version(table):
+    return version_cache.get((table,))[0]
+
+
+def table_versions(tables):
+    return version_cache.get(tables)
+
+
+# ---------- SQL INSTRUMENTATION ----------
+
+slow_sql_log = app.logger.getChild("slow_sql")
+if SQL_SLOW_LOG:
+    _slow_sql_handler = logging.FileHandler(SQL_SLOW_LOG)
+    _slow_sql_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_sql_log.addHandler(_slow_sql_handler)
+    slow_sql_log.setLevel(logging.INFO)
+
+_EXPLAINABLE = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.I)
+
+
+def explain_query(sql, parameters):
+    """The engine's query plan for a logged statement, as text."""
+    if not _EXPLAINABLE.match(sql) or not isinstance(parameters, (tuple, list, dict)):
+        return ""
+    prefix = "EXPLAIN " if DB_ENGINE == "postgres" else "EXPLAIN QUERY PLAN "
+    try:
+        rows = get_db().execute(prefix + sql, parameters).fetchall()
+    except DatabaseError as e:
+        return f"(no plan: {e})"
+    # SQLite: (id, parent, notused, detail); PostgreSQL: one text column
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+def sql_footer(entries, total_ms):
+    slowest = sorted(entries, key=lambda e: e[2], reverse=True)[:SQL_FOOTER_TOP]
+    lines = [f"{len(entries)} queries, {total_ms:.2f} ms"]
+    for sql, parameters, seconds in slowest:
+        lines.append(f"\n{seconds * 1000:.2f} ms  {' '.join(sql.split())}")
+        lines.append(f"params: {parameters!r}")
+        plan = explain_query(sql, parameters)
+        if plan:
+            lines.append(plan)
+    return Markup('<pre class="sql-debug">{}</pre>').format("\n".join(lines))
+
+
+@app.after_request
+def report_queries(response):
+    """
+    Puts the request's query count and DB time on the response, logs slow
+    statements with their plan and warns about statements repeated often
+    enough to look like a query per row (N+1).
+    """
+    entries = g.pop("sql_log", None)
+    if not entries:
+        return response
+    g.sql_totals = (len(entries), sum(e[2] for e in entries))
+    total_ms = g.sql_totals[1] * 1000
+    response.headers["X-SQL-Count"] = str(len(entries))
+    response.headers["Server-Timing"] = f'db;dur={total_ms:.2f};desc="{len(entries)} queries"'
+
+    where = f"{request.method} {request.path}"
+    for sql, count in Counter(e[0] for e in entries).items():
+        if count > SQL_REPEAT_WARN:
+            app.logger.warning(
+                "%s ran one statement %d times: %s", where, count, " ".join(sql.split())
+            )
+    for sql, parameters, seconds in entries:
+        if seconds * 1000 >= SQL_SLOW_MS:
+            message = f"{seconds * 1000:.1f} ms in {where}: {' '.join(sql.split())} params={parameters!r}"
+            plan = explain_query(sql, parameters)
+            slow_sql_log.warning(f"{message}\n{plan}" if plan else message)
+
+    if SQL_DEBUG_FOOTER and response.mimetype == "text/html" and not response.is_streamed:
+        html = response.get_data(as_text=True)
+        footer = sql_footer(entries, total_ms)
+        if "</body>" in html:
+            html = html.replace("</body>", f"{footer}</body>", 1)
+        else:
+            html += footer
+        response.set_data(html)
+    # The plan lookups above are not part of the request's own work
+    g.pop("sql_log", None)
+    return response
+
+
+def sql_totals():
+    """(statements, seconds) the current request has spent on SQL."""
+    entries = g.get("sql_log")
+    if entries is not None:
+        return len(entries), sum(e[2] for e in entries)
+    return g.get("sql_totals", (0, 0.0))
+
+
+# ---------- METRICS ----------
+
+if METRICS:
+    REQUEST_LATENCY = prometheus_client.Histogram(
+        "hive_request_duration_seconds",
+        "Time spent handling a request",
+        ["endpoint", "method"],
+    )
+    REQUESTS = prometheus_client.Counter(
+        "hive_requests_total",
+        "Requests handled, by response status",
+        ["endpoint", "method", "status"],
+    )
+    REQUESTS_IN_FLIGHT = prometheus_client.Gauge(
+        "hive_requests_in_flight",
+        "Requests being handled right now",
+        ["endpoint"],
+        multiprocess_mode="livesum",
+    )
+    DB_LATENCY = prometheus_client.Histogram(
+        "hive_request_db_seconds",
+        "Time a request spent running SQL",
+        ["endpoint"],
+        buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+    )
+    DB_QUERIES = prometheus_client.Counter(
+        "hive_db_queries_total",
+        "SQL statements run",
+        ["endpoint"],
+    )
+    UPLOAD_BYTES = prometheus_client.Histogram(
+        "hive_upload_bytes",
+        "Size of multipart (file upload) request bodies",
+        ["endpoint"],
+        buckets=(16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20),
+    )
+
+
+def metrics_endpoint():
+    # Unrouted requests (404s, bad methods) share one label so scanners
+    # can't grow the series count
+    return request.endpoint or "unmatched"
+
+
+if METRICS:
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.labels(metrics_endpoint()).inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get("metrics_started")
+        if started is None:
+            return response
+        endpoint = metrics_endpoint()
+        REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+        statements, seconds = sql_totals()
+        if statements:
+            DB_QUERIES.labels(endpoint).inc(statements)
+            DB_LATENCY.labels(endpoint).observe(seconds)
+        if request.mimetype == "multipart/form-data" and request.content_length:
+            UPLOAD_BYTES.labels(endpoint).observe(request.content_length)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        if g.pop("metrics_started", None) is not None:
+            REQUESTS_IN_FLIGHT.labels(metrics_endpoint()).dec()
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus text exposition of the request metrics."""
+    if not METRICS:
+        abort(404)
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        abort(403)
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = prometheus_client.CollectorRegistry()
+        prometheus_multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(
+        prometheus_client.generate_latest(registry),
+        content_type=prometheus_client.CONTENT_TYPE_LATEST,
+    )
 
 
 def init_db():
-    db = get_db()
+    db = connect_db()
+    if DB_ENGINE == "postgres":
+        try:
+            bootstrap_postgres(db)
+        finally:
+            db.close()
+        return
     c = db.cursor()
 
     # Users / owners
@@ -167,9 +974,454 @@ def init_db():
     )
 
     db.commit()
+    migrate_db(db)
     db.close()
 
 
+# ---------- SCHEMA MIGRATIONS ----------
+
+def fts_index(table, columns):
+    """
+    Statements for an external-content FTS5 index <table>_fts over
+    `columns`, kept in sync with the source table by triggers and filled
+    from existing rows.
+    """
+    fts = f"{table}_fts"
+    cols = ", ".join(columns)
+    new_vals = ", ".join(f"new.{col}" for col in columns)
+    old_vals = ", ".join(f"old.{col}" for col in columns)
+    delete_old = (
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_vals});"
+    )
+    insert_new = f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_vals});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{cols}, content='{table}', content_rowid='id')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"{insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"{delete_old} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+        f"{delete_old} {insert_new} END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def table_version_triggers(table):
+    """
+    Statements that bump table_versions.<table> on every write to `table`,
+    so any worker can tell whether data it cached is still current.
+    """
+    bump = f"UPDATE table_versions SET version = version + 1 WHERE name = '{table}';"
+    return [
+        f"INSERT OR IGNORE INTO table_versions (name, version) VALUES ('{table}', 0)",
+    ] + [
+        f"CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} "
+        f"AFTER {event} ON {table} BEGIN {bump} END"
+        for event in ("INSERT", "UPDATE", "DELETE")
+    ]
+
+
+# Denormalized counts kept in the counters table: name -> query yielding
+# (id, count) from the source table. toggle_follow() and toggle_interested()
+# keep them current; `flask --app app reconcile-counters` rebuilds them.
+COUNTER_SOURCES = {
+    "followers": "SELECT followed_id, COUNT(*) FROM follows GROUP BY followed_id",
+    "following": "SELECT follower_id, COUNT(*) FROM follows GROUP BY follower_id",
+    "interested": "SELECT icecan_id, COUNT(*) FROM interested GROUP BY icecan_id",
+}
+
+
+# Numbered migrations, applied once each in order. The last applied number
+# is stored in PRAGMA user_version. Never edit a shipped migration; append a
+# new one instead.
+MIGRATIONS = [
+    (
+        1,
+        "secondary indexes for foreign-key lookups",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_icecans_owner ON icecans(owner_id)",
+            "CREATE INDEX IF NOT EXISTS idx_posts_owner ON posts(owner_id)",
+            "CREATE INDEX IF NOT EXISTS idx_websites_owner ON websites(owner_id)",
+            "CREATE INDEX IF NOT EXISTS idx_materials_owner ON materials(owner_id)",
+            "CREATE INDEX IF NOT EXISTS idx_follows_followed ON follows(followed_id)",
+            "CREATE INDEX IF NOT EXISTS idx_interested_icecan ON interested(icecan_id)",
+            "CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages(sender_id, receiver_id)",
+            "CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages(receiver_id, sender_id)",
+        ],
+    ),
+    (
+        2,
+        "full-text search indexes for /search",
+        fts_index("users", ["username", "location", "created_at"])
+        + fts_index("icecans", ["title", "description", "location", "created_at"])
+        + fts_index("posts", ["content", "created_at"]),
+    ),
+    (
+        3,
+        "per-table write counters for cache invalidation",
+        [
+            "CREATE TABLE IF NOT EXISTS table_versions ("
+            "name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)",
+        ]
+        + table_version_triggers("icecans")
+        + table_version_triggers("posts"),
+    ),
+    (
+        4,
+        "write counters for the remaining content tables",
+        table_version_triggers("users")
+        + table_version_triggers("websites")
+        + table_version_triggers("materials")
+        + table_version_triggers("follows")
+        + table_version_triggers("interested")
+        + table_version_triggers("messages"),
+    ),
+    (
+        5,
+        "conversation index for the Messenger inbox",
+        [
+            # One row per participant and conversation partner, rewritten on
+            # every send_message; see record_message()
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "user_id INTEGER NOT NULL, "
+            "other_id INTEGER NOT NULL, "
+            "last_message_id INTEGER NOT NULL, "
+            "last_sender_id INTEGER NOT NULL, "
+            "last_at TEXT, "
+            "preview TEXT, "
+            "unread INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (user_id, other_id))",
+            "CREATE INDEX IF NOT EXISTS idx_conversations_recent "
+            "ON conversations(user_id, last_message_id)",
+            "INSERT OR IGNORE INTO conversations "
+            "(user_id, other_id, last_message_id, last_sender_id, last_at, preview) "
+            "SELECT p.user_id, p.other_id, m.id, m.sender_id, m.created_at, "
+            "substr(m.content, 1, 80) "
+            "FROM (SELECT user_id, other_id, MAX(id) AS last_id FROM ("
+            "SELECT sender_id AS user_id, receiver_id AS other_id, id FROM messages "
+            "UNION ALL "
+            "SELECT receiver_id, sender_id, id FROM messages) "
+            "GROUP BY user_id, other_id) AS p "
+            "JOIN messages AS m ON m.id = p.last_id",
+        ]
+        + table_version_triggers("conversations"),
+    ),
+    (
+        6,
+        "denormalized follower, following and interested counts",
+        [
+            "CREATE TABLE IF NOT EXISTS counters ("
+            "name TEXT NOT NULL, id INTEGER NOT NULL, value INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (name, id)) WITHOUT ROWID",
+        ]
+        + [
+            f"INSERT OR REPLACE INTO counters (name, id, value) SELECT '{name}', * FROM ({sql})"
+            for name, sql in COUNTER_SOURCES.items()
+        ],
+    ),
+    (
+        7,
+        "activities and per-follower timelines for the home feed",
+        [
+            # pushed=1 once the activity is in every follower's timeline
+            "CREATE TABLE IF NOT EXISTS activities ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "kind TEXT NOT NULL, "
+            "item_id INTEGER NOT NULL, "
+            "author_id INTEGER NOT NULL, "
+            "created_at TEXT, "
+            "pushed INTEGER NOT NULL DEFAULT 0)",
+            "CREATE INDEX IF NOT EXISTS idx_activities_author ON activities(author_id, id)",
+            "CREATE INDEX IF NOT EXISTS idx_activities_pull "
+            "ON activities(author_id, id) WHERE pushed = 0",
+            "CREATE TABLE IF NOT EXISTS timeline ("
+            "user_id INTEGER NOT NULL, activity_id INTEGER NOT NULL, "
+            "PRIMARY KEY (user_id, activity_id)) WITHOUT ROWID",
+            "INSERT INTO activities (kind, item_id, author_id, created_at, pushed) "
+            "SELECT kind, id, owner_id, created_at, 1 FROM ("
+            "SELECT 'post' AS kind, id, owner_id, created_at FROM posts "
+            "UNION ALL "
+            "SELECT 'icecan', id, owner_id, created_at FROM icecans) "
+            "ORDER BY created_at, kind, id",
+            "INSERT OR IGNORE INTO timeline (user_id, activity_id) "
+            "SELECT f.follower_id, a.id FROM activities AS a "
+            "JOIN follows AS f ON f.followed_id = a.author_id",
+        ],
+    ),
+    (
+        8,
+        "ordered follower and interested indexes that don't rely on rowid",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_follows_fanout ON follows(followed_id, follower_id)",
+            "CREATE INDEX IF NOT EXISTS idx_interested_recent "
+            "ON interested(icecan_id, created_at)",
+            # Both are prefixes of the new indexes
+            "DROP INDEX IF EXISTS idx_follows_followed",
+            "DROP INDEX IF EXISTS idx_interested_icecan",
+        ],
+    ),
+]
+
+
+def schema_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate_db(db):
+    """
+    Applies every migration newer than the database's user_version. Each
+    migration runs in its own IMMEDIATE transaction, so gunicorn workers
+    starting at the same time apply it exactly once.
+    """
+    for number, description, statements in MIGRATIONS:
+        if number <= schema_version(db):
+            continue
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have applied it while we waited for the lock
+            if number <= schema_version(db):
+                db.rollback()
+                continue
+            for sql in statements:
+                db.execute(sql)
+            db.execute(f"PRAGMA user_version = {int(number)}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        app.logger.info("Applied migration %s: %s", number, description)
+
+
+# Full-text documents for PostgreSQL search, one expression per table with
+# {t} standing for an optional table alias. The GIN indexes in PG_SCHEMA are
+# built on these same expressions, which keeps the search queries indexed.
+PG_FTS_DOCUMENTS = {
+    "users": "to_tsvector('simple', coalesce({t}username, '') || ' ' || "
+    "coalesce({t}location, '') || ' ' || coalesce({t}created_at, ''))",
+    # Weighted like the bm25() column weights of the SQLite search
+    "icecans": "setweight(to_tsvector('simple', coalesce({t}title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce({t}location, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce({t}description, '')), 'C') || "
+    "setweight(to_tsvector('simple', coalesce({t}created_at, '')), 'D')",
+    "posts": "to_tsvector('simple', coalesce({t}content, '') || ' ' || "
+    "coalesce({t}created_at, ''))",
+}
+
+# Tables whose writes bump table_versions, as the SQLite triggers do
+_VERSIONED_TABLES = [
+    "icecans", "posts", "users", "websites", "materials",
+    "follows", "interested", "messages", "conversations",
+]
+
+# The PostgreSQL schema as of SQLite migration 8, which a new database gets
+# in one go. Leave it as it is: later schema changes go into PG_MIGRATIONS
+# (next to their SQLite MIGRATIONS entry, same number) so that existing
+# PostgreSQL databases are upgraded too.
+PG_SCHEMA_VERSION = 8
+PG_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE,
+        password TEXT,
+        contact TEXT,
+        bio TEXT,
+        location TEXT,
+        profile_image TEXT,
+        website TEXT,
+        created_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS icecans (
+        id SERIAL PRIMARY KEY,
+        title TEXT,
+        description TEXT,
+        location TEXT,
+        capacity TEXT,
+        quote TEXT,
+        image_url TEXT,
+        owner_id INTEGER REFERENCES users(id),
+        created_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS follows (
+        follower_id INTEGER REFERENCES users(id),
+        followed_id INTEGER REFERENCES users(id),
+        created_at TEXT,
+        PRIMARY KEY (follower_id, followed_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS interested (
+        user_id INTEGER REFERENCES users(id),
+        icecan_id INTEGER REFERENCES icecans(id),
+        created_at TEXT,
+        PRIMARY KEY (user_id, icecan_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id SERIAL PRIMARY KEY,
+        sender_id INTEGER REFERENCES users(id),
+        receiver_id INTEGER REFERENCES users(id),
+        content TEXT,
+        created_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS websites (
+        id SERIAL PRIMARY KEY,
+        owner_id INTEGER REFERENCES users(id),
+        url TEXT,
+        description TEXT,
+        created_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS materials (
+        id SERIAL PRIMARY KEY,
+        owner_id INTEGER REFERENCES users(id),
+        name TEXT,
+        description TEXT,
+        created_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS posts (
+        id SERIAL PRIMARY KEY,
+        owner_id INTEGER REFERENCES users(id),
+        content TEXT,
+        image_url TEXT,
+        created_at TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS settings (
+        user_id INTEGER PRIMARY KEY REFERENCES users(id),
+        show_contact INTEGER DEFAULT 1,
+        allow_messages INTEGER DEFAULT 1,
+        dark_theme INTEGER DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS conversations (
+        user_id INTEGER NOT NULL,
+        other_id INTEGER NOT NULL,
+        last_message_id INTEGER NOT NULL,
+        last_sender_id INTEGER NOT NULL,
+        last_at TEXT,
+        preview TEXT,
+        unread INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, other_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (name, id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS activities (
+        id SERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        item_id INTEGER NOT NULL,
+        author_id INTEGER NOT NULL,
+        created_at TEXT,
+        pushed INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS timeline (
+        user_id INTEGER NOT NULL,
+        activity_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, activity_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS table_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_icecans_owner ON icecans(owner_id)",
+    "CREATE INDEX IF NOT EXISTS idx_posts_owner ON posts(owner_id)",
+    "CREATE INDEX IF NOT EXISTS idx_websites_owner ON websites(owner_id)",
+    "CREATE INDEX IF NOT EXISTS idx_materials_owner ON materials(owner_id)",
+    "CREATE INDEX IF NOT EXISTS idx_follows_fanout ON follows(followed_id, follower_id)",
+    "CREATE INDEX IF NOT EXISTS idx_interested_recent ON interested(icecan_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_pair ON messages(sender_id, receiver_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages(receiver_id, sender_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_conversations_recent "
+    "ON conversations(user_id, last_message_id)",
+    "CREATE INDEX IF NOT EXISTS idx_activities_author ON activities(author_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_activities_pull "
+    "ON activities(author_id, id) WHERE pushed = 0",
+]
+PG_SCHEMA += [
+    f"CREATE INDEX IF NOT EXISTS idx_{table}_fts ON {table} USING GIN (({document.format(t='')}))"
+    for table, document in PG_FTS_DOCUMENTS.items()
+]
+PG_SCHEMA += [
+    """
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = TG_TABLE_NAME;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+]
+for _table in _VERSIONED_TABLES:
+    PG_SCHEMA += [
+        f"INSERT INTO table_versions (name, version) VALUES ('{_table}', 0) "
+        "ON CONFLICT DO NOTHING",
+        f"DROP TRIGGER IF EXISTS {_table}_version ON {_table}",
+        f"CREATE TRIGGER {_table}_version AFTER INSERT OR UPDATE OR DELETE ON {_table} "
+        "FOR EACH ROW EXECUTE PROCEDURE bump_table_version()",
+    ]
+
+
+# (number, description, statements) applied in order on top of PG_SCHEMA,
+# in PostgreSQL's dialect; see PG_SCHEMA_VERSION
+PG_MIGRATIONS = []
+
+# pg_advisory_xact_lock key serializing schema changes between workers
+PG_SCHEMA_LOCK = 0x48495645
+
+
+def bootstrap_postgres(db):
+    """
+    Creates the PostgreSQL schema on an empty database and applies every
+    PG_MIGRATIONS entry newer than its schema_version, all in one
+    transaction. An advisory lock makes workers starting together do it
+    only once.
+    """
+    db.execute("SELECT pg_advisory_xact_lock(?)", (PG_SCHEMA_LOCK,))
+    db.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    (current,) = db.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    if current is None:
+        for sql in PG_SCHEMA:
+            db.execute(sql)
+        current = PG_SCHEMA_VERSION
+        db.execute("INSERT INTO schema_version (version) VALUES (?)", (current,))
+        app.logger.info("Created PostgreSQL schema version %s", current)
+    for number, description, statements in PG_MIGRATIONS:
+        if number <= current:
+            continue
+        for sql in statements:
+            db.execute(sql)
+        db.execute("UPDATE schema_version SET version=?", (number,))
+        current = number
+        app.logger.info("Applied PostgreSQL migration %s: %s", number, description)
+    db.commit()
+
+
 init_db()
 
 # ---------- TEMPLATE SHELL (MAIN LAYOUT + TRANSITIONS) ----------
@@ -179,316 +1431,10 @@ TEMPLATE = """
 <html>
 <head>
     <title>3JMCO Hive</title>
-    <style>
-        body {
-            font-family: Arial, sans-serif;
-            background: url("{{ url_for('static', filename='images/background.png') }}") no-repeat center center fixed;
-            background-size: cover;
-            margin: 0;
-        }
-        .page {
-            background: #00000066;
-            min-height: 100vh;
-            opacity: 0;
-            transform: translateY(10px);
-            transition: opacity 0.35s ease, transform 0.35s ease;
-        }
-        .page.page-slide-in {
-            opacity: 1;
-            transform: translateY(0);
-        }
-        .container {
-            width: 95%;
-            max-width: 1100px;
-            margin: 0 auto;
-            padding-bottom: 40px;
-        }
-        .card {
-            background: #ffffffdd;
-            border-radius: 12px;
-            padding: 20px;
-            margin-bottom: 20px;
-            box-shadow: 0 4px 8px rgba(0,0,0,0.2);
-        }
-        .topbar {
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-            padding: 10px 0 20px 0;
-        }
-        .logo {
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-        .logo img {
-            max-height: 48px;
-        }
-        .nav {
-            display: flex;
-            gap: 10px;
-            flex-wrap: wrap;
-        }
-        .nav a {
-            padding: 8px 12px;
-            border-radius: 20px;
-            background: #ffffff33;
-            color: #fff;
-            text-decoration: none;
-            font-size: 14px;
-        }
-        .nav a.active {
-            background: #0f9b0f;
-            font-weight: bold;
-        }
-        h2 {
-            margin-top: 0;
-        }
-        input, textarea, button, select {
-            width: 100%;
-            padding: 8px;
-            margin-top: 6px;
-            box-sizing: border-box;
-        }
-        textarea {
-            resize: vertical;
-            min-height: 60px;
-        }
-        button {
-            background: #0f9b0f;
-            color: white;
-            border: none;
-            border-radius: 6px;
-            cursor: pointer;
-            font-weight: bold;
-            transition: transform 0.08s ease, box-shadow 0.08s ease, background 0.15s ease;
-        }
-        button:hover {
-            background: #0c7a0c;
-        }
-        button:active {
-            transform: scale(0.96);
-            box-shadow: 0 0 10px #0f9b0f;
-        }
-        .messages {
-            margin-bottom: 10px;
-        }
-        .msg {
-            background-color: #e0ffe0;
-            border-left: 4px solid #0f9b0f;
-            padding: 8px;
-            margin-bottom: 5px;
-            border-radius: 4px;
-            font-size: 13px;
-        }
-        .msg.error {
-            background-color: #ffe0e0;
-            border-left-color: #ff0000;
-        }
-        .flex {
-            display: flex;
-            gap: 20px;
-            flex-wrap: wrap;
-        }
-        .half {
-            flex: 1;
-            min-width: 260px;
-        }
-        .icecan-card, .user-card, .post-card, .website-card, .material-card {
-            border: 2px solid #0f9b0f;
-            padding: 10px;
-            border-radius: 8px;
-            margin-bottom: 8px;
-            background: #ffffff;
-        }
-        .icecan-card a, .user-card a, .post-card a, .website-card a, .material-card a {
-            color: #0f9b0f;
-            text-decoration: none;
-        }
-        .small {
-            font-size: 12px;
-            color: #555;
-        }
-        .chat {
-            max-height: 300px;
-            overflow-y: auto;
-            border: 1px solid #ccc;
-            padding: 8px;
-            border-radius: 8px;
-            background: #fafafa;
-            margin-bottom: 8px;
-        }
-        .chat-msg {
-            margin-bottom: 6px;
-        }
-        .chat-self {
-            text-align: right;
-        }
-        .pill-btn {
-            display: inline-block;
-            padding: 5px 10px;
-            border-radius: 999px;
-            background: #0f9b0f;
-            color: #fff;
-            font-size: 12px;
-            text-decoration: none;
-            margin-right: 6px;
-        }
-
-        /* Route transition overlay */
-        .route-overlay {
-            position: fixed;
-            inset: 0;
-            background: rgba(0, 0, 0, 0.88);
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            opacity: 0;
-            pointer-events: none;
-            transition: opacity 0.3s ease;
-            z-index: 9999;
-        }
-        .route-overlay.show {
-            opacity: 1;
-            pointer-events: auto;
-        }
-        .route-overlay-content {
-            text-align: center;
-            color: #00ffcc;
-            font-size: 26px;
-            letter-spacing: 2px;
-            text-shadow: 0 0 10px #00ffcc, 0 0 20px #0f9bff;
-            animation: routeSlideUp 0.35s ease-out forwards;
-        }
-        .route-overlay-label {
-            margin-top: 8px;
-            font-size: 16px;
-            color: #88ffff;
-        }
-        .route-overlay-gear {
-            margin: 15px auto;
-            width: 70px;
-            height: 70px;
-            border-radius: 50%;
-            border: 4px solid #00ffcc;
-            border-top-color: #0f9bff;
-            box-shadow: 0 0 15px #00ffcc;
-            animation: spin 1.2s linear infinite;
-            position: relative;
-        }
-        .route-overlay-gear::before {
-            content: "";
-            position: absolute;
-            inset: 20%;
-            border-radius: 50%;
-            border: 3px dashed #0f9bff;
-            opacity: 0.7;
-            animation: spin 3s linear infinite reverse;
-        }
-
-        @keyframes routeSlideUp {
-            from {
-                transform: translateY(40px);
-                opacity: 0;
-            }
-            to {
-                transform: translateY(0);
-                opacity: 1;
-            }
-        }
-        @keyframes spin {
-            to { transform: rotate(360deg); }
-        }
-    </style>
-    <script>
-        function togglePassword(fieldId, toggleId) {
-            const field = document.getElementById(fieldId);
-            const toggle = document.getElementById(toggleId);
-            if (!field) return;
-
-            if (field.type === "password") {
-                field.type = "text";
-                if (toggle) toggle.textContent = "Hide";
-            } else {
-                field.type = "password";
-                if (toggle) toggle.textContent = "Show";
-            }
-        }
-
-        document.addEventListener("DOMContentLoaded", function () {
-            // Slide-in animation for page (on refresh / direct open)
-            const page = document.querySelector(".page");
-            if (page) {
-                requestAnimationFrame(function () {
-                    page.classList.add("page-slide-in");
-                });
-            }
-
-            const overlay = document.getElementById("route-overlay");
-            const labelEl = document.getElementById("route-overlay-label");
-            const titleEl = document.getElementById("route-overlay-title");
-
-            function showOverlay(text) {
-                if (!overlay) return;
-                if (labelEl) {
-                    labelEl.textContent = text || "Loading...";
-                }
-                if (titleEl) {
-                    titleEl.textContent = "3JMCO HIVE";
-                }
-                overlay.classList.add("show");
-            }
-
-            function handleLinkClick(e) {
-                const a = e.currentTarget;
-                const href = a.getAttribute("href");
-
-                if (!href) return;
-
-                // Don't intercept external or new-tab links or anchors
-                const isExternal = href.startsWith("http") && !href.startsWith(window.location.origin);
-                if (isExternal || a.target === "_blank" || href.startsWith("#")) {
-                    return;
-                }
-
-                e.preventDefault();
-
-                let label = a.dataset.transitionLabel || "";
-
-                // If no custom label, decide by current page (leaving) or target (entering)
-                if (!label) {
-                    const path = window.location.pathname || "";
-                    if (path.startsWith("/settings")) {
-                        label = "Going on...";
-                    } else if (path.startsWith("/profile")) {
-                        label = "Going to user...";
-                    } else if (href.startsWith("{{ url_for('settings_page') }}")) {
-                        label = "Going on...";
-                    } else if (href.startsWith("{{ url_for('profile', user_id=0)[:-1] }}")) {
-                        // crude match for /profile/<id>
-                        label = "Going to user...";
-                    } else {
-                        label = "Loading...";
-                    }
-                }
-
-                showOverlay(label);
-
-                setTimeout(function () {
-                    window.location = href;
-                }, 350);
-            }
-
-            // Attach to all internal nav links we mark with data-transition="true"
-            const links = document.querySelectorAll("a[data-transition='true']");
-            links.forEach(function (a) {
-                a.addEventListener("click", handleLinkClick);
-            });
-        });
-    </script>
-
+    <link rel="stylesheet" href="{{ asset_url('css/app.css') }}">
+    <script src="{{ asset_url('js/app.js') }}" defer></script>
 </head>
-<body>
+<body data-settings-url="{{ url_for('settings_page') }}" data-profile-url="{{ url_for('profile', user_id=0)[:-1] }}" data-user-id="{{ user['id'] if user else '' }}" data-stream-url="{{ url_for('message_stream') }}">
 <div id="route-overlay" class="route-overlay">
     <div class="route-overlay-content">
         <div id="route-overlay-title">3JMCO HIVE</div>
@@ -502,25 +1448,25 @@ TEMPLATE = """
 
     <div class="topbar">
         <div class="logo">
-            <img src="{{ url_for('static', filename='images/logo.png') }}" alt="logo">
+            <img src="{{ asset_url('images/logo.png') }}" alt="logo">
             <div style="color:#fff;">
                 <div><b>3JMCO hive</b></div>
                 <div class="small"><b>Stainless Steel Fabrication Service.</b> Connect with owners, services, materials & projects</div>
             </div>
         </div>
         <div class="nav">
-            <a href="{{ url_for('home') }}" data-transition="true" class="{% if tab=='home' %}active{% endif %}">Home</a>
-            <a href="{{ url_for('icecans') }}" data-transition="true" class="{% if tab=='icecans' %}active{% endif %}">Ice Cans / Services</a>
-            <a href="{{ url_for('owners') }}" data-transition="true" class="{% if tab=='owners' %}active{% endif %}">Members</a>
-            <a href="{{ url_for('websites_page') }}" data-transition="true" class="{% if tab=='websites' %}active{% endif %}">Websites</a>
-            <a href="{{ url_for('materials_page') }}" data-transition="true" class="{% if tab=='materials' %}active{% endif %}">Materials</a>
-            <a href="{{ url_for('messages_page') }}" data-transition="true" class="{% if tab=='messages' %}active{% endif %}">Messenger</a>
+            <a href="{{ url_for('home') }}" data-transition="true" data-tab="home" class="{% if tab=='home' %}active{% endif %}">Home</a>
+            <a href="{{ url_for('icecans') }}" data-transition="true" data-tab="icecans" class="{% if tab=='icecans' %}active{% endif %}">Ice Cans / Services</a>
+            <a href="{{ url_for('owners') }}" data-transition="true" data-tab="owners" class="{% if tab=='owners' %}active{% endif %}">Members</a>
+            <a href="{{ url_for('websites_page') }}" data-transition="true" data-tab="websites" class="{% if tab=='websites' %}active{% endif %}">Websites</a>
+            <a href="{{ url_for('materials_page') }}" data-transition="true" data-tab="materials" class="{% if tab=='materials' %}active{% endif %}">Materials</a>
+            <a href="{{ url_for('messages_page') }}" data-transition="true" data-tab="messages" class="{% if tab=='messages' %}active{% endif %}">Messenger</a>
             {% if user %}
-                <a href="{{ url_for('profile', user_id=user['id']) }}" data-transition="true" data-transition-label="Going to user..." class="{% if tab=='profile' %}active{% endif %}">Profile</a>
-                <a href="{{ url_for('settings_page') }}" data-transition="true" data-transition-label="Going on..." class="{% if tab=='settings' %}active{% endif %}">Settings</a>
-                <a href="{{ url_for('logout') }}" data-transition="true" data-transition-label="Logging out...">Logout</a>
+                <a href="{{ url_for('profile', user_id=user['id']) }}" data-transition="true" data-transition-label="Going to user..." data-tab="profile" class="{% if tab=='profile' %}active{% endif %}">Profile</a>
+                <a href="{{ url_for('settings_page') }}" data-transition="true" data-transition-label="Going on..." data-tab="settings" class="{% if tab=='settings' %}active{% endif %}">Settings</a>
+                <a href="{{ url_for('logout') }}" data-transition="true" data-transition-label="Logging out..." data-prefetch="false">Logout</a>
             {% else %}
-                <a href="{{ url_for('login_page') }}" data-transition="true" class="{% if tab=='auth' %}active{% endif %}">Login / Register</a>
+                <a href="{{ url_for('login_page') }}" data-transition="true" data-tab="auth" class="{% if tab=='auth' %}active{% endif %}">Login / Register</a>
             {% endif %}
         </div>
     </div>
@@ -537,7 +1483,9 @@ TEMPLATE = """
         {% endwith %}
     </div>
 
-    {{ body|safe }}
+    <div id="page-body">
+    {% block body %}{% endblock %}
+    </div>
 
 </div>
 </div>
@@ -644,22 +1592,574 @@ INTRO_TEMPLATE = """
 </html>
 """
 
+# ---------- TEMPLATE LOADER ----------
+
+class PageLoader(BaseLoader):
+    """
+    Serves the in-code templates: the layout, the intro and every page body
+    passed to render_page(). Sources never change while the process runs,
+    so Jinja compiles each one once and keeps it in its template cache.
+    """
+
+    def __init__(self):
+        self.sources = {}
+        self._page_names = {}
+
+    def get_source(self, environment, name):
+        if name not in self.sources:
+            raise TemplateNotFound(name)
+        return self.sources[name], None, lambda: True
+
+    def add(self, name, source):
+        self.sources[name] = source
+        return name
+
+    def page(self, body_html):
+        """
+        Returns the template name for a route body, registering it on first
+        use as a child of layout.html. Names are derived from the source so
+        every worker (and the bytecode cache) agrees on them.
+        """
+        name = self._page_names.get(body_html)
+        if name is None:
+            digest = hashlib.sha1(body_html.encode("utf-8")).hexdigest()[:16]
+            name = self.add(
+                f"pages/{digest}.html",
+                '{% extends "layout.html" %}{% block body %}'
+                + body_html
+                + "{% endblock %}",
+            )
+            self._page_names[body_html] = name
+        return name
+
+    def fragment(self, html):
+        """
+        Like page(), but for standalone snippets that don't extend the layout.
+        """
+        name = self._page_names.get(html)
+        if name is None:
+            digest = hashlib.sha1(html.encode("utf-8")).hexdigest()[:16]
+            name = self.add(f"fragments/{digest}.html", html)
+            self._page_names[html] = name
+        return name
+
+
+page_loader = PageLoader()
+page_loader.add("layout.html", TEMPLATE)
+page_loader.add("intro.html", INTRO_TEMPLATE)
+
+# Must be set before app.jinja_env is first used
+app.jinja_options = {
+    **app.jinja_options,
+    "loader": ChoiceLoader([page_loader, app.create_global_jinja_loader()]),
+    "cache_size": TEMPLATE_CACHE_SIZE,
+}
+if TEMPLATE_BYTECODE_DIR:
+    os.makedirs(TEMPLATE_BYTECODE_DIR, exist_ok=True)
+    app.jinja_options["bytecode_cache"] = FileSystemBytecodeCache(TEMPLATE_BYTECODE_DIR)
+
+# ---------- STATIC ASSETS ----------
+
+# `flask --app app build-assets` writes optimized, content-hashed copies of
+# static/images and minified CSS/JS bundles into static/dist plus a manifest;
+# asset_url() looks names up there and falls back to the source file when
+# nothing has been built.
+STATIC_DIST = "dist"
+ASSET_MANIFEST_PATH = os.path.join(app.static_folder, STATIC_DIST, "manifest.json")
+# Extra widths (px) built for large images, each as WebP and JPEG
+ASSET_IMAGE_WIDTHS = {"images/background.png": (640, 1024, 1536)}
+ASSET_IMAGE_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 6}),
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+# Text bundles, built after the images so CSS can point at hashed images
+ASSET_BUNDLES = ["css/app.css", "js/app.js"]
+
+
+def load_asset_manifest():
+    try:
+        with open(ASSET_MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def asset_sources():
+    """
+    Source files build_assets() reads, relative to the static folder.
+    """
+    images = sorted(
+        f"images/{entry}"
+        for entry in os.listdir(os.path.join(app.static_folder, "images"))
+        if os.path.splitext(entry)[1].lower() in (".png", ".jpg", ".jpeg", ".webp")
+    )
+    return images + ASSET_BUNDLES
+
+
+def source_digest(rel):
+    with open(os.path.join(app.static_folder, *rel.split("/")), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:10]
+
+
+asset_manifest = load_asset_manifest()
+# Pages embed the hashed bundle URLs, so their ETags depend on the manifest
+ASSET_DIGEST = hashlib.sha1(json.dumps(asset_manifest, sort_keys=True).encode("utf-8")).hexdigest()
+if asset_manifest.get("_sources") != {rel: source_digest(rel) for rel in asset_sources()}:
+    app.logger.warning(
+        "static/dist is out of date with its sources; run `flask --app app build-assets`"
+    )
+
+
+def asset_key(filename, width=None, fmt=None):
+    """
+    Manifest key for a built output: images/background.png with width 640
+    and fmt "webp" is images/background-640.webp.
+    """
+    base, ext = os.path.splitext(filename)
+    if width:
+        base = f"{base}-{width}"
+    return base + (f".{fmt}" if fmt else ext)
+
+
+@app.template_global()
+def asset_url(filename, width=None, fmt=None):
+    name = asset_manifest.get(asset_key(filename, width, fmt), filename)
+    return url_for("static", filename=name)
+
+
+@app.after_request
+def cache_built_assets(response):
+    # Built files have their content hash in the name, so cache them for good
+    filename = (request.view_args or {}).get("filename", "")
+    if request.endpoint == "static" and filename.startswith(STATIC_DIST + "/"):
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def write_hashed_asset(out_root, key, data):
+    """
+    Writes data as <key stem>.<hash><ext> under out_root and returns its
+    path relative to the static folder.
+    """
+    base, ext = os.path.splitext(key)
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    rel = f"{STATIC_DIST}/{base}.{digest}{ext}"
+    path = os.path.join(app.static_folder, *rel.split("/"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return rel
+
+
+def encode_image(im, fmt):
+    if fmt in ASSET_IMAGE_FORMATS:
+        pil_format, options = ASSET_IMAGE_FORMATS[fmt]
+    else:
+        # Re-save in the source format, losslessly
+        pil_format, options = fmt.upper(), {"optimize": True}
+    if pil_format == "JPEG" and im.mode != "RGB":
+        im = im.convert("RGB")
+    buf = io.BytesIO()
+    im.save(buf, pil_format, **options)
+    return buf.getvalue()
+
+
+def minify_css(text):
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s*([{}:;,>])\s*", r"\1", text)
+    return text.replace(";}", "}").strip()
+
+
+def minify_js(text):
+    # Conservative: drop indentation, blank lines and whole-line comments but
+    # keep line breaks so automatic semicolon insertion still applies
+    lines = (line.strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("//"))
+
+
+def rewrite_css_urls(css, key, manifest):
+    """
+    Points url(...) references in a CSS bundle at the hashed files, relative
+    to where the bundle itself is written.
+    """
+    src_dir = posixpath.dirname(key)
+    out_dir = posixpath.dirname(f"{STATIC_DIST}/{key}")
+
+    def replace(m):
+        target = posixpath.normpath(posixpath.join(src_dir, m.group(2)))
+        if target not in manifest:
+            return m.group(0)
+        return f'url("{posixpath.relpath(manifest[target], out_dir)}")'
+
+    return re.sub(r"""url\((["']?)([^"')]+)\1\)""", replace, css)
+
+
+def prune_dist(out_root, manifests):
+    """
+    Deletes files under out_root that none of `manifests` points at (the
+    manifest file itself is kept).
+    """
+    keep = {
+        rel
+        for manifest in manifests
+        for key, rel in manifest.items()
+        if not key.startswith("_")
+    }
+    for dirpath, _, filenames in os.walk(out_root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            rel = posixpath.join(STATIC_DIST, os.path.relpath(path, out_root).replace(os.sep, "/"))
+            if path != ASSET_MANIFEST_PATH and rel not in keep:
+                os.remove(path)
+
+
+def build_assets():
+    """
+    Rebuilds static/dist from static/images and the CSS/JS bundles and
+    returns the new manifest. The previous build's files are kept, since
+    pages cached by browsers (or served by workers not yet restarted) still
+    point at them; anything older is deleted.
+    """
+    if Image is None:
+        raise click.ClickException("Pillow is required to build image assets.")
+
+    out_root = os.path.join(app.static_folder, STATIC_DIST)
+    previous = load_asset_manifest()
+    manifest = {}
+
+    images_dir = os.path.join(app.static_folder, "images")
+    for entry in sorted(os.listdir(images_dir)):
+        src_ext = os.path.splitext(entry)[1].lower().lstrip(".")
+        if src_ext not in ("png", "jpg", "jpeg", "webp"):
+            continue
+        rel = f"images/{entry}"
+        with Image.open(os.path.join(images_dir, entry)) as im:
+            im.load()
+            widths = ASSET_IMAGE_WIDTHS.get(rel)
+            outputs = []
+            if widths:
+                # Large images are only ever referenced by width
+                for width in widths:
+                    resized = im.copy()
+                    resized.thumbnail((width, width * 10))
+                    for fmt in ASSET_IMAGE_FORMATS:
+                        outputs.append((asset_key(rel, width, fmt), resized, fmt))
+            else:
+                # Same format, recompressed, plus a WebP copy
+                outputs.append((rel, im, "jpg" if src_ext == "jpeg" else src_ext))
+                outputs.append((asset_key(rel, None, "webp"), im, "webp"))
+
+            for key, image, fmt in outputs:
+                manifest[key] = write_hashed_asset(out_root, key, encode_image(image, fmt))
+
+    for key in ASSET_BUNDLES:
+        with open(os.path.join(app.static_folder, *key.split("/")), encoding="utf-8") as f:
+            text = f.read()
+        if key.endswith(".css"):
+            text = rewrite_css_urls(minify_css(text), key, manifest)
+        else:
+            text = minify_js(text)
+        manifest[key] = write_hashed_asset(out_root, key, text.encode("utf-8"))
+
+    manifest["_sources"] = {rel: source_digest(rel) for rel in asset_sources()}
+    with open(ASSET_MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    prune_dist(out_root, [manifest, previous])
+    return manifest
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Build hashed, compressed static assets into static/dist."""
+    global asset_manifest
+    asset_manifest = build_assets()
+    for key, rel in sorted(asset_manifest.items()):
+        if key.startswith("_"):
+            continue
+        size = os.path.getsize(os.path.join(app.static_folder, *rel.split("/")))
+        click.echo(f"{key:40} -> {rel} ({size // 1024} KiB)")
+
+
+# ---------- COUNTERS ----------
+
+def bump_counter(db, name, key, delta):
+    """
+    Adds `delta` to counter `name` for `key`. Call it in the same
+    transaction as the write it counts so the two commit together.
+    """
+    db.execute(
+        "INSERT INTO counters (name, id, value) VALUES (?,?,?) "
+        "ON CONFLICT(name, id) DO UPDATE SET value = counters.value + excluded.value",
+        (name, key, delta),
+    )
+
+
+def read_counters(db, names, key):
+    """Returns the values of counters `names` for `key`, 0 where unset."""
+    placeholders = ",".join("?" for _ in names)
+    rows = db.execute(
+        f"SELECT name, value FROM counters WHERE id=? AND name IN ({placeholders})",
+        (key, *names),
+    ).fetchall()
+    values = dict(rows)
+    return [values.get(name, 0) for name in names]
+
+
+def begin_write(db, table):
+    """
+    Opens a transaction that keeps other writers off `table` until it ends
+    (SQLite can only lock the whole database).
+    """
+    if DB_ENGINE == "postgres":
+        db.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+    else:
+        db.execute("BEGIN IMMEDIATE")
+
+
+def reconcile_counters(db):
+    """
+    Recomputes every counter from its source table in one transaction and
+    returns how many stored values were wrong (missing ones included).
+    """
+    begin_write(db, "counters")
+    try:
+        stored = {(name, key): value for name, key, value in db.execute(
+            "SELECT name, id, value FROM counters"
+        )}
+        fresh = {}
+        for name, sql in COUNTER_SOURCES.items():
+            for key, value in db.execute(sql):
+                fresh[(name, key)] = value
+        wrong = sum(
+            1 for item in stored.keys() | fresh.keys()
+            if stored.get(item, 0) != fresh.get(item, 0)
+        )
+        db.execute("DELETE FROM counters")
+        db.executemany(
+            "INSERT INTO counters (name, id, value) VALUES (?,?,?)",
+            [(name, key, value) for (name, key), value in fresh.items()],
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return wrong
+
+
+@app.cli.command("reconcile-counters")
+def reconcile_counters_command():
+    """Rebuild follower/following/interested counts from their tables."""
+    db = connect_db()
+    try:
+        wrong = reconcile_counters(db)
+    finally:
+        db.close()
+    click.echo(f"Rebuilt counters; {wrong} were out of date.")
+
+# ---------- TIMELINE ----------
+
+timeline_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="timeline")
+
+# Items of a newly followed member copied into the follower's timeline
+TIMELINE_FOLLOW_BACKFILL = 50
+
+
+def add_activity(db, kind, item_id, author_id, created_at):
+    """
+    Records a new post or ice can for the home feed, in the transaction
+    that inserts the item. Returns the activity id to hand to fan_out()
+    after the commit, or None when there is nothing to push: no followers,
+    or more than TIMELINE_FANOUT_LIMIT, whose feeds pull it instead.
+    """
+    (followers,) = read_counters(db, ["followers"], author_id)
+    c = db.execute(
+        "INSERT INTO activities (kind, item_id, author_id, created_at, pushed) "
+        "VALUES (?,?,?,?,?)",
+        (kind, item_id, author_id, created_at, 1 if followers == 0 else 0),
+    )
+    if 0 < followers <= TIMELINE_FANOUT_LIMIT:
+        return c.lastrowid
+    return None
+
+
+def fan_out(activity_id, author_id):
+    """Pushes an activity into the followers' timelines on a background thread."""
+    if activity_id is not None:
+        timeline_executor.submit(push_activity, activity_id, author_id)
+
+
+def push_activity(activity_id, author_id):
+    db = db_pool.acquire()
+    try:
+        after = 0
+        while True:
+            # Walk the followers in order off idx_follows_fanout, one short
+            # write transaction per batch. follows stays locked from reading
+            # the batch to inserting it, so an unfollow can't slip in between
+            # and get the item put back after follow_timeline() removed it.
+            begin_write(db, "follows")
+            (last,) = db.execute(
+                "SELECT max(follower_id) FROM (SELECT follower_id FROM follows "
+                "WHERE followed_id=? AND follower_id > ? ORDER BY follower_id LIMIT ?) AS batch",
+                (author_id, after, TIMELINE_FANOUT_BATCH),
+            ).fetchone()
+            if last is None:
+                db.commit()
+                break
+            db.execute(
+                "INSERT OR IGNORE INTO timeline (user_id, activity_id) "
+                "SELECT follower_id, ? FROM follows "
+                "WHERE followed_id=? AND follower_id > ? AND follower_id <= ?",
+                (activity_id, author_id, after, last),
+            )
+            db.commit()
+            after = last
+        db.execute("UPDATE activities SET pushed=1 WHERE id=?", (activity_id,))
+        db.commit()
+    except Exception:
+        app.logger.exception("Timeline fan-out failed for activity %s", activity_id)
+    finally:
+        db_pool.release(db)
+
+
+def follow_timeline(db, user_id, author_id, following):
+    """
+    Adds an author's recent activities to a new follower's timeline, or
+    takes them all out on unfollow. Part of the caller's transaction.
+    Unpushed activities are copied too: a fan-out that is still running
+    may already have passed the new follower's id.
+    """
+    if following:
+        db.execute(
+            "INSERT OR IGNORE INTO timeline (user_id, activity_id) "
+            "SELECT ?, id FROM activities WHERE author_id=? "
+            "ORDER BY id DESC LIMIT ?",
+            (user_id, author_id, TIMELINE_FOLLOW_BACKFILL),
+        )
+    else:
+        db.execute(
+            "DELETE FROM timeline WHERE user_id=? AND activity_id IN "
+            "(SELECT id FROM activities WHERE author_id=?)",
+            (user_id, author_id),
+        )
+
+
+def feed_page(db, user_id, before, limit):
+    """
+    One page of a member's home feed, newest first, as rows of
+    (activity_id, kind, item_id, author_id, username, created_at, text,
+    image_url, location), plus the cursor for the next page. Merges the
+    pushed timeline with activities pulled from the member themself and
+    from followed authors that still have unpushed ones.
+    """
+    ids = [
+        row[0] for row in db.execute(
+            "SELECT activity_id FROM timeline WHERE user_id=? AND activity_id < ? "
+            "ORDER BY activity_id DESC LIMIT ?",
+            (user_id, before, limit + 1),
+        )
+    ]
+    pull_authors = [user_id] + [
+        row[0] for row in db.execute(
+            "SELECT f.followed_id FROM follows AS f WHERE f.follower_id=? AND EXISTS ("
+            "SELECT 1 FROM activities AS a WHERE a.author_id = f.followed_id AND a.pushed = 0)",
+            (user_id,),
+        )
+    ]
+    for author_id in pull_authors:
+        ids += [
+            row[0] for row in db.execute(
+                "SELECT id FROM activities WHERE author_id=? AND id < ? "
+                "ORDER BY id DESC LIMIT ?",
+                (author_id, before, limit + 1),
+            )
+        ]
+    ids = sorted(set(ids), reverse=True)[: limit + 1]
+    if not ids:
+        return [], None
+
+    placeholders = ",".join("?" for _ in ids)
+    rows = db.execute(
+        "SELECT a.id, a.kind, a.item_id, a.author_id, u.username, a.created_at, "
+        "COALESCE(p.content, i.title), COALESCE(p.image_url, i.image_url), i.location "
+        "FROM activities AS a JOIN users AS u ON u.id = a.author_id "
+        "LEFT JOIN posts AS p ON a.kind = 'post' AND p.id = a.item_id "
+        "LEFT JOIN icecans AS i ON a.kind = 'icecan' AND i.id = a.item_id "
+        f"WHERE a.id IN ({placeholders}) ORDER BY a.id DESC",
+        tuple(ids),
+    ).fetchall()
+    return keyset_page(rows, limit)
+
 # ---------- HELPERS ----------
 
-def current_user():
-    if "user_id" not in session:
-        return None
+class LRUCache:
+    """
+    Bounded, thread-safe least-recently-used cache. Entries older than
+    `ttl` seconds are treated as missing so other workers' writes show up
+    eventually even without an explicit invalidation.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# User rows by id, shared across requests of this worker
+user_cache = LRUCache(USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def load_user(user_id):
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
     db = get_db()
     c = db.cursor()
     c.execute(
         "SELECT id, username, contact, bio, location, profile_image, website FROM users WHERE id=?",
-        (session["user_id"],),
+        (user_id,),
     )
     row = c.fetchone()
-    db.close()
     if not row:
         return None
-    return {
+    user = {
         "id": row[0],
         "username": row[1],
         "contact": row[2],
@@ -668,21 +2168,73 @@ def current_user():
         "profile_image": row[5],
         "website": row[6],
     }
+    user_cache.set(user_id, user)
+    return user
+
+
+def invalidate_user(user_id):
+    """
+    Drops a user's cached row. Call after anything that changes the users
+    table for that id.
+    """
+    user_cache.invalidate(user_id)
+    cached = g.get("current_user")
+    if cached is not None and cached[0] == user_id:
+        g.pop("current_user")
+
+
+def current_user():
+    """
+    Returns the logged-in user as a dict, or None. The lookup is memoized
+    on flask.g, so a request hits the cache/DB at most once.
+    """
+    if "user_id" not in session:
+        return None
+    user_id = session["user_id"]
+    cached = g.get("current_user")
+    if cached is not None and cached[0] == user_id:
+        return cached[1]
+    user = load_user(user_id)
+    g.current_user = (user_id, user)
+    return user
+
+
+# Sent by the page scripts on in-app navigation; the response is then just
+# the page body as JSON instead of a whole document
+FRAGMENT_HEADER = "X-Hive-Fragment"
+
+
+def wants_fragment():
+    return request.headers.get(FRAGMENT_HEADER) == "1"
 
 
 def render_page(tab, body_html, **kwargs):
-    inner_html = render_template_string(
-        body_html,
-        tab=tab,
-        user=current_user(),
-        **kwargs
-    )
-    return render_template_string(
-        TEMPLATE,
-        tab=tab,
-        user=current_user(),
-        body=inner_html
+    name = page_loader.page(body_html)
+    user = current_user()
+    if wants_fragment():
+        return render_body(name, tab=tab, user=user, **kwargs)
+    return render_template(name, tab=tab, user=user, **kwargs)
+
+
+def render_body(name, **context):
+    """
+    Render only the body block of page `name`, along with what the page
+    scripts need to update the shell around it: the active tab and any
+    flash messages. Whose session it is goes along too, so the scripts
+    can fall back to a full load when login state changed under them.
+    """
+    template = app.jinja_env.get_template(name)
+    app.update_template_context(context)
+    html = "".join(template.blocks["body"](template.new_context(context)))
+    user = context["user"]
+    rv = jsonify(
+        html=html,
+        tab=context["tab"],
+        user_id=user["id"] if user else None,
+        flashes=get_flashed_messages(with_categories=True),
     )
+    rv.vary.add(FRAGMENT_HEADER)
+    return rv
 
 
 def require_login():
@@ -692,34 +2244,248 @@ def require_login():
     return True
 
 
-def save_uploaded_file(field_name, subfolder=""):
+# Keyset pagination for list pages: ?before=<id>&limit=N
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+_NO_CURSOR = 2 ** 63 - 1  # larger than any SQLite rowid
+
+
+def page_args():
+    """
+    Reads ?before= and ?limit= from the request. Returns (before, limit)
+    where `before` is always usable in a `WHERE id < ?` seek.
+    """
+    before = request.args.get("before", type=int) or _NO_CURSOR
+    limit = request.args.get("limit", PAGE_SIZE, type=int)
+    return before, min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+def keyset_page(rows, limit):
+    """
+    Trims rows fetched with LIMIT limit + 1 to one page and returns
+    (rows, next_before), where next_before is the id (column 0) to pass as
+    ?before= for the following page, or None on the last page.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, rows[-1][0]
+
+
+def page_etag(tables):
+    """
+    Strong ETag for the current URL: the write counters of every table the
+    page reads, plus who is looking at it.
+    """
+    parts = [ETAG_SALT, ASSET_DIGEST, request.full_path, str(session.get("user_id", ""))]
+    # Full pages and body fragments of the same URL are different entities
+    parts.append(FRAGMENT_HEADER if wants_fragment() else "")
+    parts += [f"{t}={v}" for t, v in zip(tables, table_versions(tables))]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def conditional(*tables):
+    """
+    Decorator for GET views whose output depends only on `tables` and the
+    viewer. Answers a matching If-None-Match with 304 before the view runs.
+    Requests with pending flash messages are always rendered in full and
+    get no ETag, since the flashes are part of the page.
+    """
+    if "users" not in tables:
+        # The nav bar and nearly every list show usernames
+        tables += ("users",)
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD") or session.get("_flashes"):
+                return view(*args, **kwargs)
+
+            etag = page_etag(tables)
+            if request.if_none_match.contains(etag):
+                rv = make_response("", 304)
+            else:
+                rv = make_response(view(*args, **kwargs))
+                if rv.status_code != 200:
+                    return rv
+            rv.set_etag(etag)
+            rv.headers["Cache-Control"] = "private, no-cache"
+            rv.vary.add(FRAGMENT_HEADER)
+            return rv
+
+        return wrapper
+
+    return decorator
+
+
+def render_fragment(html, **context):
+    return Markup(render_template(page_loader.fragment(html), **context))
+
+
+class FragmentCache:
+    """
+    Rendered HTML fragments, each tagged with the table_versions value of
+    the table it was built from. Versions come from version_cache, so other
+    workers' writes are noticed within FRAGMENT_RECHECK seconds; writes
+    made by this worker drop affected entries at once via invalidate_table().
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, table, render):
+        version = table_version(table)
+        entry = self._entries.get(name)
+        if entry is None or entry["version"] != version:
+            entry = {"table": table, "version": version, "html": render()}
+            with self._lock:
+                self._entries[name] = entry
+        return entry["html"]
+
+    def invalidate_table(self, table):
+        with self._lock:
+            for name in [n for n, e in self._entries.items() if e["table"] == table]:
+                del self._entries[name]
+
+
+fragment_cache = FragmentCache()
+
+
+# Uploads are stored once per distinct content under
+# uploads/blobs/<aa>/<bb>/<sha256><ext>
+BLOB_DIR = "blobs"
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def save_uploaded_file(field_name):
     """
-    Saves an uploaded file from request.files[field_name] into uploads/subfolder
-    and returns a URL path like /uploads/subfolder/filename.ext
-    or None if no file was uploaded.
+    Streams request.files[field_name] to disk in chunks while hashing it,
+    stores it content-addressed (identical files are kept once) and returns
+    its URL path like /uploads/blobs/ab/cd/<sha256>.png, or None if no file
+    was uploaded.
     """
     file = request.files.get(field_name)
     if not file or file.filename == "":
         return None
 
-    filename = secure_filename(file.filename)
-
-    folder = app.config["UPLOAD_FOLDER"]
-    if subfolder:
-        folder = os.path.join(folder, subfolder)
-    os.makedirs(folder, exist_ok=True)
+    ext = os.path.splitext(secure_filename(file.filename))[1].lower()[:10]
 
-    ts = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-    name, ext = os.path.splitext(filename)
-    filename = f"{ts}_{name}{ext}"
+    root = app.config["UPLOAD_FOLDER"]
+    tmp_dir = os.path.join(root, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
 
-    filepath = os.path.join(folder, filename)
-    file.save(filepath)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                out.write(chunk)
+
+        h = digest.hexdigest()
+        rel = f"{BLOB_DIR}/{h[:2]}/{h[2:4]}/{h}{ext}"
+        path = os.path.join(root, *rel.split("/"))
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            if IMAGE_PIPELINE:
+                image_executor.submit(make_variants, rel)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
-    rel = f"{subfolder}/{filename}" if subfolder else filename
     return f"/uploads/{rel}"
 
 
+@app.errorhandler(413)
+def upload_too_large(e):
+    limit_mb = app.config["MAX_CONTENT_LENGTH"] / (1024 * 1024)
+    flash(f"Upload is too large (max {limit_mb:g} MB).", "error")
+    return redirect(request.referrer or url_for("home"))
+
+
+# ---------- IMAGE VARIANTS ----------
+
+VARIANT_DIR = "variants"
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-variants")
+
+# Blobs Pillow couldn't read, so their variant URLs redirect straight away
+_not_images = set()
+
+# The only shape variant_rel() produces; anything else (such as "..") is
+# refused before the path reaches the disk
+_VARIANT_PATH = re.compile(
+    rf"^{VARIANT_DIR}/({'|'.join(map(re.escape, IMAGE_VARIANTS))})/"
+    rf"([0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{64}}(?:\.[a-z0-9_-]{{1,9}})?)"
+    rf"{re.escape(IMAGE_VARIANT_FORMAT[1])}$"
+)
+
+
+def variant_rel(blob_rel, name):
+    """
+    blobs/ab/cd/<sha256>.png -> variants/<name>/ab/cd/<sha256>.png.webp
+    """
+    return f"{VARIANT_DIR}/{name}/{blob_rel[len(BLOB_DIR) + 1:]}{IMAGE_VARIANT_FORMAT[1]}"
+
+
+def variant_source(rel):
+    """
+    Inverse of variant_rel(): the blob a variant path was made from, or None.
+    """
+    m = _VARIANT_PATH.match(rel)
+    return f"{BLOB_DIR}/{m.group(2)}" if m else None
+
+
+def upload_path(rel):
+    return os.path.join(app.config["UPLOAD_FOLDER"], *rel.split("/"))
+
+
+def make_variants(blob_rel):
+    """
+    Writes every IMAGE_VARIANTS size of an uploaded blob. Returns False if
+    the blob isn't an image Pillow can read. Safe to run concurrently for
+    the same blob: each file is written to a temp name and renamed.
+    """
+    if blob_rel in _not_images:
+        return False
+    try:
+        with Image.open(upload_path(blob_rel)) as im:
+            im = ImageOps.exif_transpose(im)
+            if im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if im.mode in ("LA", "P", "PA") else "RGB")
+            for name, width in IMAGE_VARIANTS.items():
+                dest = upload_path(variant_rel(blob_rel, name))
+                if os.path.exists(dest):
+                    continue
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                copy = im.copy()
+                copy.thumbnail((width, width * 10))
+                tmp = f"{dest}.{threading.get_ident()}.tmp"
+                copy.save(tmp, IMAGE_VARIANT_FORMAT[0], quality=IMAGE_VARIANT_QUALITY)
+                os.replace(tmp, dest)
+        return True
+    except (OSError, Image.DecompressionBombError) as e:
+        app.logger.warning("No image variants for %s: %s", blob_rel, e)
+        _not_images.add(blob_rel)
+        return False
+
+
+@app.template_filter("variant")
+def image_variant(url, name):
+    """
+    Jinja filter: URL of the `name` variant of an uploaded image. External
+    links and pre-blob uploads are returned unchanged.
+    """
+    prefix = "/uploads/"
+    if not IMAGE_PIPELINE or not url or not url.startswith(prefix + BLOB_DIR + "/"):
+        return url
+    return prefix + variant_rel(url[len(prefix):], name)
+
+
 def ensure_intro(target_endpoint, **values):
     """
     Show intro once before first entering the app (home) in this session.
@@ -735,40 +2501,64 @@ def ensure_intro(target_endpoint, **values):
 @app.route("/intro")
 def intro():
     next_page = session.pop("after_intro", url_for("home"))
-    return render_template_string(INTRO_TEMPLATE, next=next_page)
+    return render_template("intro.html", next=next_page)
+
+
+# Content-addressed blobs and their variants, and older uploads whose
+# names start with a 20-digit timestamp, never change behind their URL
+_IMMUTABLE_UPLOAD = re.compile(r"^(blobs|variants)/|(^|/)\d{20}_[^/]+$")
 
 
 @app.route("/uploads/<path:filename>")
 def uploaded_file(filename):
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+    if safe_join(app.config["UPLOAD_FOLDER"], filename) is None:
+        abort(404)
+    if filename.startswith(VARIANT_DIR + "/") and not os.path.isfile(upload_path(filename)):
+        # Background resize hasn't finished (or the worker restarted): do it
+        # now, or fall back to the original if it can't be resized
+        blob = variant_source(filename)
+        if blob is None or not os.path.isfile(upload_path(blob)):
+            abort(404)
+        if not (IMAGE_PIPELINE and make_variants(blob)):
+            return redirect(f"/uploads/{blob}")
+
+    if UPLOAD_SERVE_MODE == "x-accel":
+        path = safe_join(app.config["UPLOAD_FOLDER"], filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        rv = make_response("")
+        rv.headers["X-Accel-Redirect"] = UPLOAD_ACCEL_PREFIX + filename
+        rv.mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    else:
+        # send_file answers Range and conditional requests itself
+        rv = send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+
+    if _IMMUTABLE_UPLOAD.search(filename):
+        rv.cache_control.public = True
+        rv.cache_control.max_age = IMMUTABLE_MAX_AGE
+        rv.cache_control.immutable = True
+        rv.cache_control.no_cache = None
+    return rv
 
 
 # ---------- ROUTES: HOME / SEARCH / AUTH ----------
 
 @app.route("/")
+@conditional("icecans", "posts", "follows")
 def home():
     # Intro before first "entering" the app in this session
     intro_redirect = ensure_intro("home")
     if intro_redirect:
         return intro_redirect
 
-    db = get_db()
-    c = db.cursor()
-
-    c.execute(
-        "SELECT i.id, i.title, i.location, i.capacity, i.quote, u.username "
-        "FROM icecans i JOIN users u ON u.id = i.owner_id "
-        "ORDER BY i.id DESC LIMIT 5"
-    )
-    icecans = c.fetchall()
+    icecans_panel = fragment_cache.get("home_icecans", "icecans", render_latest_icecans)
+    posts_panel = fragment_cache.get("home_posts", "posts", render_latest_posts)
 
-    c.execute(
-        "SELECT p.id, p.content, p.image_url, p.created_at, u.username, u.id "
-        "FROM posts p JOIN users u ON u.id = p.owner_id "
-        "ORDER BY p.id DESC LIMIT 5"
-    )
-    posts = c.fetchall()
-    db.close()
+    user = current_user()
+    feed, next_before = [], None
+    before, limit = page_args()
+    if user:
+        feed, next_before = feed_page(get_db(), user["id"], before, limit)
 
     body = """
     <div class="card">
@@ -779,42 +2569,47 @@ def home():
         </form>
     </div>
 
+    {% if user %}
+    <div class="card">
+        <h3>Your feed</h3>
+        {% if feed %}
+            {% for f in feed %}
+                {% if f[1] == 'post' %}
+                <div class="post-card">
+                    <div class="small">
+                        <a href="{{ url_for('profile', user_id=f[3]) }}"><b>{{ f[4] }}</b></a>
+                        · {{ f[5] }}
+                    </div>
+                    <div>{{ f[6] }}</div>
+                    {% if f[7] %}
+                        <div><img src="{{ f[7]|variant('card') }}" style="max-width:100%; margin-top:4px;"></div>
+                    {% endif %}
+                </div>
+                {% else %}
+                <div class="icecan-card">
+                    <a href="{{ url_for('icecan_detail', icecan_id=f[2]) }}"><b>{{ f[6] }}</b></a><br>
+                    <span class="small">New service by <a href="{{ url_for('profile', user_id=f[3]) }}">{{ f[4] }}</a> · {{ f[8] }} · {{ f[5] }}</span>
+                </div>
+                {% endif %}
+            {% endfor %}
+            {% if next_before %}
+                <a class="pill-btn" href="{{ url_for('home', before=next_before, limit=limit) }}">Load more</a>
+            {% endif %}
+        {% else %}
+            <p class="small">Follow members to see their posts and services here.</p>
+        {% endif %}
+    </div>
+    {% endif %}
+
     <div class="flex">
         <div class="card half">
             <h3>Latest Ice Cans / Services</h3>
-            {% if icecans %}
-                {% for i in icecans %}
-                    <div class="icecan-card">
-                        <a href="{{ url_for('icecan_detail', icecan_id=i[0]) }}"><b>{{ i[1] }}</b></a><br>
-                        <span class="small">Owner: {{ i[5] }} · Location: {{ i[2] }} · Capacity: {{ i[3] }}</span><br>
-                        {% if i[4] %}
-                        <span class="small">Quote: {{ i[4] }}</span>
-                        {% endif %}
-                    </div>
-                {% endfor %}
-            {% else %}
-                <p>No ice cans yet.</p>
-            {% endif %}
+            {{ icecans_panel }}
         </div>
 
         <div class="card half">
             <h3>Latest Community Posts</h3>
-            {% if posts %}
-                {% for p in posts %}
-                    <div class="post-card">
-                        <div class="small">
-                            <a href="{{ url_for('profile', user_id=p[5]) }}"><b>{{ p[4] }}</b></a>
-                            · {{ p[3] }}
-                        </div>
-                        <div>{{ p[1] }}</div>
-                        {% if p[2] %}
-                            <div><img src="{{ p[2] }}" style="max-width:100%; margin-top:4px;"></div>
-                        {% endif %}
-                    </div>
-                {% endfor %}
-            {% else %}
-                <p>No posts yet.</p>
-            {% endif %}
+            {{ posts_panel }}
             
             {% if user %}
             <h4>Create a post</h4>
@@ -836,44 +2631,224 @@ def home():
         </div>
     </div>
     """
-    return render_page("home", body, icecans=icecans, posts=posts)
+    return render_page(
+        "home",
+        body,
+        icecans_panel=icecans_panel,
+        posts_panel=posts_panel,
+        feed=feed,
+        next_before=next_before,
+        limit=limit,
+    )
 
 
-@app.route("/search")
-def search():
-    q = request.args.get("q", "").strip()
-    like = f"%{q}%"
+def render_latest_icecans():
+    c = get_db().cursor()
+    c.execute(
+        "SELECT i.id, i.title, i.location, i.capacity, i.quote, u.username "
+        "FROM icecans i JOIN users u ON u.id = i.owner_id "
+        "ORDER BY i.id DESC LIMIT 5"
+    )
+    icecans = c.fetchall()
+
+    html = """
+    {% if icecans %}
+        {% for i in icecans %}
+            <div class="icecan-card">
+                <a href="{{ url_for('icecan_detail', icecan_id=i[0]) }}"><b>{{ i[1] }}</b></a><br>
+                <span class="small">Owner: {{ i[5] }} · Location: {{ i[2] }} · Capacity: {{ i[3] }}</span><br>
+                {% if i[4] %}
+                <span class="small">Quote: {{ i[4] }}</span>
+                {% endif %}
+            </div>
+        {% endfor %}
+    {% else %}
+        <p>No ice cans yet.</p>
+    {% endif %}
+    """
+    return render_fragment(html, icecans=icecans)
 
-    db = get_db()
-    c = db.cursor()
 
+def render_latest_posts():
+    c = get_db().cursor()
     c.execute(
-        "SELECT id, username, location FROM users "
-        "WHERE username LIKE ? OR location LIKE ? OR created_at LIKE ? "
-        "ORDER BY id DESC",
-        (like, like, like),
+        "SELECT p.id, p.content, p.image_url, p.created_at, u.username, u.id "
+        "FROM posts p JOIN users u ON u.id = p.owner_id "
+        "ORDER BY p.id DESC LIMIT 5"
+    )
+    posts = c.fetchall()
+
+    html = """
+    {% if posts %}
+        {% for p in posts %}
+            <div class="post-card">
+                <div class="small">
+                    <a href="{{ url_for('profile', user_id=p[5]) }}"><b>{{ p[4] }}</b></a>
+                    · {{ p[3] }}
+                </div>
+                <div>{{ p[1] }}</div>
+                {% if p[2] %}
+                    <div><img src="{{ p[2]|variant('card') }}" style="max-width:100%; margin-top:4px;"></div>
+                {% endif %}
+            </div>
+        {% endfor %}
+    {% else %}
+        <p>No posts yet.</p>
+    {% endif %}
+    """
+    return render_fragment(html, posts=posts)
+
+
+# Results per section on one /search page
+SEARCH_PAGE_SIZE = 20
+
+# Private-use sentinels that mark FTS hits until the text has been escaped
+_HIT_START, _HIT_END = "\ue000", "\ue001"
+
+
+def fts_query(q):
+    """
+    Turns free text into a safe FTS5 query: every word becomes a quoted
+    prefix term, and all terms must match.
+    """
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", q))
+
+
+def pg_tsquery(q):
+    """fts_query() for PostgreSQL's to_tsquery()."""
+    return " & ".join(f"{word}:*" for word in re.findall(r"\w+", q))
+
+
+def pg_search(c, q, limit, offset):
+    """
+    The full-text half of search() on PostgreSQL. Returns rows shaped like
+    the FTS5 ones: ranked by ts_rank, with hits wrapped in the _HIT_START/
+    _HIT_END sentinels by ts_headline.
+    """
+    tsquery = pg_tsquery(q)
+    hit = f"StartSel={_HIT_START}, StopSel={_HIT_END}"
+    whole = hit + ", HighlightAll=true"
+    users_doc = PG_FTS_DOCUMENTS["users"].format(t="u.")
+    icecans_doc = PG_FTS_DOCUMENTS["icecans"].format(t="i.")
+    posts_doc = PG_FTS_DOCUMENTS["posts"].format(t="p.")
+
+    c.execute(
+        "SELECT u.id, u.username, u.location, ts_headline('simple', u.username, query, ?) "
+        "FROM users u CROSS JOIN to_tsquery('simple', ?) AS query "
+        f"WHERE {users_doc} @@ query "
+        f"ORDER BY ts_rank({users_doc}, query) DESC LIMIT ? OFFSET ?",
+        (whole, tsquery, limit, offset),
     )
     owners = c.fetchall()
 
     c.execute(
-        "SELECT i.id, i.title, i.location, i.capacity, u.username "
+        "SELECT i.id, i.title, i.location, i.capacity, u.username, "
+        "ts_headline('simple', i.title, query, ?), "
+        "ts_headline('simple', coalesce(i.description, ''), query, ?) "
         "FROM icecans i JOIN users u ON u.id = i.owner_id "
-        "WHERE i.title LIKE ? OR i.description LIKE ? OR i.location LIKE ? OR i.created_at LIKE ? "
-        "ORDER BY i.id DESC",
-        (like, like, like, like),
+        "CROSS JOIN to_tsquery('simple', ?) AS query "
+        f"WHERE {icecans_doc} @@ query "
+        f"ORDER BY ts_rank({icecans_doc}, query) DESC LIMIT ? OFFSET ?",
+        (whole, hit + ", MaxFragments=1, MaxWords=16, MinWords=4", tsquery, limit, offset),
     )
     icecans = c.fetchall()
 
     c.execute(
-        "SELECT p.id, p.content, p.image_url, p.created_at, u.username, u.id "
+        "SELECT p.id, p.content, p.image_url, p.created_at, u.username, u.id, "
+        "ts_headline('simple', coalesce(p.content, ''), query, ?) "
         "FROM posts p JOIN users u ON u.id = p.owner_id "
-        "WHERE p.content LIKE ? OR p.created_at LIKE ? "
-        "ORDER BY p.id DESC",
-        (like, like),
+        "CROSS JOIN to_tsquery('simple', ?) AS query "
+        f"WHERE {posts_doc} @@ query "
+        f"ORDER BY ts_rank({posts_doc}, query) DESC LIMIT ? OFFSET ?",
+        (hit + ", MaxFragments=1, MaxWords=24, MinWords=4", tsquery, limit, offset),
     )
     posts = c.fetchall()
+    return owners, icecans, posts
 
-    db.close()
+
+def highlight_markup(text):
+    if text is None:
+        return None
+    html = str(escape(text))
+    return Markup(html.replace(_HIT_START, "<mark>").replace(_HIT_END, "</mark>"))
+
+
+@app.route("/search")
+@conditional("icecans", "posts")
+def search():
+    q = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    page_size = request.args.get("limit", SEARCH_PAGE_SIZE, type=int)
+    page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+    match = fts_query(q)
+    limit = page_size + 1
+    offset = (page - 1) * page_size
+    hit = (_HIT_START, _HIT_END)
+
+    db = get_db()
+    c = db.cursor()
+
+    if match and DB_ENGINE == "postgres":
+        owners, icecans, posts = pg_search(c, q, limit, offset)
+    elif match:
+        c.execute(
+            "SELECT u.id, u.username, u.location, "
+            "highlight(users_fts, 0, ?, ?) "
+            "FROM users_fts JOIN users u ON u.id = users_fts.rowid "
+            "WHERE users_fts MATCH ? "
+            "ORDER BY bm25(users_fts) LIMIT ? OFFSET ?",
+            (*hit, match, limit, offset),
+        )
+        owners = c.fetchall()
+
+        c.execute(
+            "SELECT i.id, i.title, i.location, i.capacity, u.username, "
+            "highlight(icecans_fts, 0, ?, ?), snippet(icecans_fts, 1, ?, ?, '…', 16) "
+            "FROM icecans_fts JOIN icecans i ON i.id = icecans_fts.rowid "
+            "JOIN users u ON u.id = i.owner_id "
+            "WHERE icecans_fts MATCH ? "
+            "ORDER BY bm25(icecans_fts, 10.0, 1.0, 2.0, 0.5) LIMIT ? OFFSET ?",
+            (*hit, *hit, match, limit, offset),
+        )
+        icecans = c.fetchall()
+
+        c.execute(
+            "SELECT p.id, p.content, p.image_url, p.created_at, u.username, u.id, "
+            "snippet(posts_fts, 0, ?, ?, '…', 24) "
+            "FROM posts_fts JOIN posts p ON p.id = posts_fts.rowid "
+            "JOIN users u ON u.id = p.owner_id "
+            "WHERE posts_fts MATCH ? "
+            "ORDER BY bm25(posts_fts) LIMIT ? OFFSET ?",
+            (*hit, match, limit, offset),
+        )
+        posts = c.fetchall()
+    else:
+        # Nothing to match on: show the newest rows instead
+        c.execute(
+            "SELECT id, username, location, username FROM users "
+            "ORDER BY id DESC LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        owners = c.fetchall()
+
+        c.execute(
+            "SELECT i.id, i.title, i.location, i.capacity, u.username, i.title, i.description "
+            "FROM icecans i JOIN users u ON u.id = i.owner_id "
+            "ORDER BY i.id DESC LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        icecans = c.fetchall()
+
+        c.execute(
+            "SELECT p.id, p.content, p.image_url, p.created_at, u.username, u.id, p.content "
+            "FROM posts p JOIN users u ON u.id = p.owner_id "
+            "ORDER BY p.id DESC LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        posts = c.fetchall()
+
+    has_more = any(len(rows) > page_size for rows in (owners, icecans, posts))
+    owners, icecans, posts = owners[:page_size], icecans[:page_size], posts[:page_size]
 
     body = """
     <div class="card">
@@ -883,7 +2858,7 @@ def search():
         {% if owners %}
             {% for o in owners %}
                 <div class="user-card">
-                    <a href="{{ url_for('profile', user_id=o[0]) }}"><b>{{ o[1] }}</b></a><br>
+                    <a href="{{ url_for('profile', user_id=o[0]) }}"><b>{{ hl(o[3]) }}</b></a><br>
                     <span class="small">{{ o[2] or 'No location' }}</span>
                 </div>
             {% endfor %}
@@ -895,8 +2870,11 @@ def search():
         {% if icecans %}
             {% for i in icecans %}
                 <div class="icecan-card">
-                    <a href="{{ url_for('icecan_detail', icecan_id=i[0]) }}"><b>{{ i[1] }}</b></a><br>
+                    <a href="{{ url_for('icecan_detail', icecan_id=i[0]) }}"><b>{{ hl(i[5]) }}</b></a><br>
                     <span class="small">Owner: {{ i[4] }} · {{ i[2] }} · {{ i[3] }}</span>
+                    {% if i[6] %}
+                    <div class="small">{{ hl(i[6]) }}</div>
+                    {% endif %}
                 </div>
             {% endfor %}
         {% else %}
@@ -911,15 +2889,37 @@ def search():
                         <a href="{{ url_for('profile', user_id=p[5]) }}"><b>{{ p[4] }}</b></a>
                         · {{ p[3] }}
                     </div>
-                    <div>{{ p[1] }}</div>
+                    <div>{{ hl(p[6]) }}</div>
                 </div>
             {% endfor %}
         {% else %}
             <p class="small">No posts found.</p>
         {% endif %}
+
+        {% if page > 1 or has_more %}
+        <p>
+            {% if page > 1 %}
+                <a class="pill-btn" href="{{ url_for('search', q=q, page=page - 1, limit=page_size) }}">Previous</a>
+            {% endif %}
+            {% if has_more %}
+                <a class="pill-btn" href="{{ url_for('search', q=q, page=page + 1, limit=page_size) }}">More results</a>
+            {% endif %}
+        </p>
+        {% endif %}
     </div>
     """
-    return render_page("home", body, q=q, owners=owners, icecans=icecans, posts=posts)
+    return render_page(
+        "home",
+        body,
+        q=q,
+        page=page,
+        page_size=page_size,
+        has_more=has_more,
+        owners=owners,
+        icecans=icecans,
+        posts=posts,
+        hl=highlight_markup,
+    )
 
 
 # ---------- AUTH ----------
@@ -989,7 +2989,7 @@ def register():
     bio = request.form.get("bio", "").strip()
 
     # Profile image: try file first, then URL
-    file_path = save_uploaded_file("profile_image_file", "profiles")
+    file_path = save_uploaded_file("profile_image_file")
     if file_path:
         profile_image = file_path
     else:
@@ -1022,6 +3022,7 @@ def register():
 
         c.execute("SELECT id FROM users WHERE username=?", (username,))
         user_id = c.fetchone()[0]
+        invalidate_user(user_id)
         c.execute(
             "INSERT INTO settings (user_id, show_contact, allow_messages, dark_theme) VALUES (?,?,?,?)",
             (user_id, 1, 1, 0),
@@ -1034,10 +3035,9 @@ def register():
         session["after_intro"] = url_for("home")
         return redirect(url_for("intro"))
 
-    except sqlite3.IntegrityError:
+    except IntegrityError:
+        db.rollback()
         flash("Username already exists. Please choose another.", "error")
-    finally:
-        db.close()
 
     return redirect(url_for("login_page"))
 
@@ -1053,7 +3053,6 @@ def login():
         "SELECT id FROM users WHERE username=? AND password=?", (username, password)
     )
     row = c.fetchone()
-    db.close()
 
     if row:
         session["user_id"] = row[0]
@@ -1077,16 +3076,18 @@ def logout():
 # ---------- ICE CANS / SERVICES ----------
 
 @app.route("/icecans")
+@conditional("icecans")
 def icecans():
     db = get_db()
     c = db.cursor()
+    before, limit = page_args()
     c.execute(
         "SELECT i.id, i.title, i.location, i.capacity, i.created_at, u.username "
         "FROM icecans i JOIN users u ON u.id = i.owner_id "
-        "ORDER BY i.id DESC"
+        "WHERE i.id < ? ORDER BY i.id DESC LIMIT ?",
+        (before, limit + 1),
     )
-    icecans = c.fetchall()
-    db.close()
+    icecans, next_before = keyset_page(c.fetchall(), limit)
 
     body = """
     <div class="card">
@@ -1128,9 +3129,14 @@ def icecans():
         {% else %}
             <p>No services yet.</p>
         {% endif %}
+        {% if next_before %}
+            <a class="pill-btn" href="{{ url_for('icecans', before=next_before, limit=limit) }}">Load more</a>
+        {% endif %}
     </div>
     """
-    return render_page("icecans", body, icecans=icecans)
+    return render_page(
+        "icecans", body, icecans=icecans, next_before=next_before, limit=limit
+    )
 
 
 @app.route("/icecans/create", methods=["POST"])
@@ -1146,7 +3152,7 @@ def create_icecan():
     quote = request.form.get("quote", "").strip()
 
     # File first
-    file_path = save_uploaded_file("image_file", "icecans")
+    file_path = save_uploaded_file("image_file")
     if file_path:
         image_url = file_path
     else:
@@ -1154,6 +3160,7 @@ def create_icecan():
 
     db = get_db()
     c = db.cursor()
+    created_at = datetime.utcnow().isoformat()
     c.execute(
         """
         INSERT INTO icecans (title, description, location, capacity, quote, image_url, owner_id, created_at)
@@ -1167,16 +3174,23 @@ def create_icecan():
             quote,
             image_url,
             user["id"],
-            datetime.utcnow().isoformat(),
+            created_at,
         ),
     )
+    activity_id = add_activity(db, "icecan", c.lastrowid, user["id"], created_at)
     db.commit()
-    db.close()
+    fan_out(activity_id, user["id"])
+    fragment_cache.invalidate_table("icecans")
     flash("Ice can / service created.", "info")
     return redirect(url_for("icecans"))
 
 
+# Interested users listed on an ice can page
+INTERESTED_SHOWN = 20
+
+
 @app.route("/icecans/<int:icecan_id>")
+@conditional("icecans", "interested")
 def icecan_detail(icecan_id):
     db = get_db()
     c = db.cursor()
@@ -1188,31 +3202,29 @@ def icecan_detail(icecan_id):
     )
     i = c.fetchone()
 
-    interested_users = []
-    if i:
-        c.execute(
-            "SELECT u.id, u.username FROM interested it "
-            "JOIN users u ON u.id = it.user_id WHERE it.icecan_id=?",
-            (icecan_id,),
-        )
-        interested_users = c.fetchall()
-    db.close()
-
     if not i:
         flash("Ice can not found.", "error")
         return redirect(url_for("icecans"))
 
+    # Only the most recent few are listed, off idx_interested_recent; the
+    # total comes from counters
+    c.execute(
+        "SELECT u.id, u.username FROM interested it "
+        "JOIN users u ON u.id = it.user_id WHERE it.icecan_id=? "
+        "ORDER BY it.created_at DESC LIMIT ?",
+        (icecan_id, INTERESTED_SHOWN),
+    )
+    interested_users = c.fetchall()
+    (interested_count,) = read_counters(db, ["interested"], icecan_id)
+
     user = current_user()
     is_interested = False
     if user:
-        db = get_db()
-        c = db.cursor()
         c.execute(
             "SELECT 1 FROM interested WHERE user_id=? AND icecan_id=?",
             (user["id"], icecan_id),
         )
         is_interested = c.fetchone() is not None
-        db.close()
 
     body = """
     <div class="card">
@@ -1232,7 +3244,7 @@ def icecan_detail(icecan_id):
         <p><b>Quotation / Offer:</b> {{ i[5] }}</p>
         {% endif %}
         {% if i[6] %}
-        <p><img src="{{ i[6] }}" style="max-width:100%;"></p>
+        <p><img src="{{ i[6]|variant('full') }}" style="max-width:100%;"></p>
         {% endif %}
 
         {% if user %}
@@ -1252,13 +3264,16 @@ def icecan_detail(icecan_id):
     </div>
 
     <div class="card">
-        <h3>People interested in this service</h3>
+        <h3>People interested in this service ({{ interested_count }})</h3>
         {% if interested_users %}
             {% for u in interested_users %}
                 <div class="user-card">
                     <a href="{{ url_for('profile', user_id=u[0]) }}">{{ u[1] }}</a>
                 </div>
             {% endfor %}
+            {% if interested_count > interested_users|length %}
+                <p class="small">and {{ interested_count - interested_users|length }} more</p>
+            {% endif %}
         {% else %}
             <p class="small">No interested users yet.</p>
         {% endif %}
@@ -1269,6 +3284,7 @@ def icecan_detail(icecan_id):
         body,
         i=i,
         interested_users=interested_users,
+        interested_count=interested_count,
         is_interested=is_interested,
     )
 
@@ -1281,39 +3297,41 @@ def toggle_interested(icecan_id):
 
     db = get_db()
     c = db.cursor()
+    # Whichever statement changes a row decides the counter update, so two
+    # racing toggles can't both count
     c.execute(
-        "SELECT 1 FROM interested WHERE user_id=? AND icecan_id=?",
+        "DELETE FROM interested WHERE user_id=? AND icecan_id=?",
         (user["id"], icecan_id),
     )
-    exists = c.fetchone() is not None
-    if exists:
-        c.execute(
-            "DELETE FROM interested WHERE user_id=? AND icecan_id=?",
-            (user["id"], icecan_id),
-        )
+    if c.rowcount:
+        bump_counter(db, "interested", icecan_id, -1)
         flash("Removed from Interested.", "info")
     else:
         c.execute(
-            "INSERT INTO interested (user_id, icecan_id, created_at) VALUES (?,?,?)",
+            "INSERT OR IGNORE INTO interested (user_id, icecan_id, created_at) VALUES (?,?,?)",
             (user["id"], icecan_id, datetime.utcnow().isoformat()),
         )
+        if c.rowcount:
+            bump_counter(db, "interested", icecan_id, 1)
         flash("Marked as Interested.", "info")
     db.commit()
-    db.close()
     return redirect(url_for("icecan_detail", icecan_id=icecan_id))
 
 
 # ---------- OWNERS / PROFILES ----------
 
 @app.route("/owners")
+@conditional("users")
 def owners():
     db = get_db()
     c = db.cursor()
+    before, limit = page_args()
     c.execute(
-        "SELECT id, username, location, created_at FROM users ORDER BY id DESC"
+        "SELECT id, username, location, created_at FROM users "
+        "WHERE id < ? ORDER BY id DESC LIMIT ?",
+        (before, limit + 1),
     )
-    owners = c.fetchall()
-    db.close()
+    owners, next_before = keyset_page(c.fetchall(), limit)
 
     body = """
     <div class="card">
@@ -1328,12 +3346,18 @@ def owners():
         {% else %}
             <p>No owners yet.</p>
         {% endif %}
+        {% if next_before %}
+            <a class="pill-btn" href="{{ url_for('owners', before=next_before, limit=limit) }}">Load more</a>
+        {% endif %}
     </div>
     """
-    return render_page("owners", body, owners=owners)
+    return render_page(
+        "owners", body, owners=owners, next_before=next_before, limit=limit
+    )
 
 
 @app.route("/profile/<int:user_id>")
+@conditional("icecans", "websites", "materials", "posts", "follows")
 def profile(user_id):
     db = get_db()
     c = db.cursor()
@@ -1345,7 +3369,6 @@ def profile(user_id):
     )
     u = c.fetchone()
     if not u:
-        db.close()
         flash("User not found.", "error")
         return redirect(url_for("owners"))
 
@@ -1367,35 +3390,24 @@ def profile(user_id):
     )
     materials = c.fetchall()
 
+    before, limit = page_args()
     c.execute(
         "SELECT p.id, p.content, p.image_url, p.created_at "
-        "FROM posts p WHERE p.owner_id=? ORDER BY p.id DESC",
-        (user_id,),
-    )
-    posts = c.fetchall()
-
-    c.execute(
-        "SELECT COUNT(*) FROM follows WHERE followed_id=?", (user_id,)
-    )
-    followers_count = c.fetchone()[0]
-    c.execute(
-        "SELECT COUNT(*) FROM follows WHERE follower_id=?", (user_id,)
+        "FROM posts p WHERE p.owner_id=? AND p.id < ? ORDER BY p.id DESC LIMIT ?",
+        (user_id, before, limit + 1),
     )
-    following_count = c.fetchone()[0]
+    posts, next_before = keyset_page(c.fetchall(), limit)
 
-    db.close()
+    followers_count, following_count = read_counters(db, ["followers", "following"], user_id)
 
     user = current_user()
     is_following = False
     if user:
-        db = get_db()
-        c = db.cursor()
         c.execute(
             "SELECT 1 FROM follows WHERE follower_id=? AND followed_id=?",
             (user["id"], user_id),
         )
         is_following = c.fetchone() is not None
-        db.close()
 
     body = """
     <div class="card">
@@ -1403,7 +3415,7 @@ def profile(user_id):
             <div class="half">
                 <h2>{{ u[1] }}</h2>
                 {% if u[5] %}
-                    <p><img src="{{ u[5] }}" style="max-width:160px; border-radius:12px;"></p>
+                    <p><img src="{{ u[5]|variant('thumb') }}" style="max-width:160px; border-radius:12px;"></p>
                 {% endif %}
                 <p>{{ u[3] or 'No bio yet.' }}</p>
                 <p class="small">
@@ -1484,13 +3496,16 @@ def profile(user_id):
                     <div class="small">{{ p[3] }}</div>
                     <div>{{ p[1] }}</div>
                     {% if p[2] %}
-                        <div><img src="{{ p[2] }}" style="max-width:100%; margin-top:4px;"></div>
+                        <div><img src="{{ p[2]|variant('card') }}" style="max-width:100%; margin-top:4px;"></div>
                     {% endif %}
                 </div>
             {% endfor %}
         {% else %}
             <p class="small">No posts yet.</p>
         {% endif %}
+        {% if next_before %}
+            <a class="pill-btn" href="{{ url_for('profile', before=next_before, limit=limit, user_id=u[0]) }}">Load more</a>
+        {% endif %}
     </div>
     """
     return render_page(
@@ -1501,6 +3516,8 @@ def profile(user_id):
         websites=websites,
         materials=materials,
         posts=posts,
+        next_before=next_before,
+        limit=limit,
         followers_count=followers_count,
         following_count=following_count,
         is_following=is_following,
@@ -1518,25 +3535,26 @@ def toggle_follow(user_id):
 
     db = get_db()
     c = db.cursor()
+    # As in toggle_interested(), the row change decides the counter update
     c.execute(
-        "SELECT 1 FROM follows WHERE follower_id=? AND followed_id=?",
+        "DELETE FROM follows WHERE follower_id=? AND followed_id=?",
         (me["id"], user_id),
     )
-    exists = c.fetchone() is not None
-    if exists:
-        c.execute(
-            "DELETE FROM follows WHERE follower_id=? AND followed_id=?",
-            (me["id"], user_id),
-        )
+    if c.rowcount:
+        delta = -1
         flash("Unfollowed user.", "info")
     else:
         c.execute(
-            "INSERT INTO follows (follower_id, followed_id, created_at) VALUES (?,?,?)",
+            "INSERT OR IGNORE INTO follows (follower_id, followed_id, created_at) VALUES (?,?,?)",
             (me["id"], user_id, datetime.utcnow().isoformat()),
         )
+        delta = 1 if c.rowcount else 0
         flash("Now following this user.", "info")
+    if delta:
+        bump_counter(db, "followers", user_id, delta)
+        bump_counter(db, "following", me["id"], delta)
+        follow_timeline(db, me["id"], user_id, delta > 0)
     db.commit()
-    db.close()
     return redirect(url_for("profile", user_id=user_id))
 
 
@@ -1550,7 +3568,7 @@ def create_post():
     content = request.form.get("content", "").strip()
 
     # Try file upload first
-    file_path = save_uploaded_file("image_file", "posts")
+    file_path = save_uploaded_file("image_file")
     # If no file, try URL from form
     if file_path:
         image_url = file_path
@@ -1563,12 +3581,15 @@ def create_post():
 
     db = get_db()
     c = db.cursor()
+    created_at = datetime.utcnow().isoformat()
     c.execute(
         "INSERT INTO posts (owner_id, content, image_url, created_at) VALUES (?,?,?,?)",
-        (user["id"], content, image_url, datetime.utcnow().isoformat()),
+        (user["id"], content, image_url, created_at),
     )
+    activity_id = add_activity(db, "post", c.lastrowid, user["id"], created_at)
     db.commit()
-    db.close()
+    fan_out(activity_id, user["id"])
+    fragment_cache.invalidate_table("posts")
     flash("Post created.", "info")
     return redirect(url_for("home"))
 
@@ -1576,6 +3597,7 @@ def create_post():
 # ---------- WEBSITES & MATERIALS ----------
 
 @app.route("/websites", methods=["GET", "POST"])
+@conditional("websites")
 def websites_page():
     if request.method == "POST":
         if not require_login():
@@ -1591,7 +3613,6 @@ def websites_page():
                 (user["id"], url_txt, desc, datetime.utcnow().isoformat()),
             )
             db.commit()
-            db.close()
             flash("Website added.", "info")
         else:
             flash("Website URL is required.", "error")
@@ -1599,13 +3620,14 @@ def websites_page():
 
     db = get_db()
     c = db.cursor()
+    before, limit = page_args()
     c.execute(
         "SELECT w.id, w.url, w.description, w.created_at, u.username, u.id "
         "FROM websites w JOIN users u ON u.id = w.owner_id "
-        "ORDER BY w.id DESC"
+        "WHERE w.id < ? ORDER BY w.id DESC LIMIT ?",
+        (before, limit + 1),
     )
-    websites = c.fetchall()
-    db.close()
+    websites, next_before = keyset_page(c.fetchall(), limit)
 
     body = """
     <div class="card">
@@ -1637,12 +3659,18 @@ def websites_page():
         {% else %}
             <p>No websites yet.</p>
         {% endif %}
+        {% if next_before %}
+            <a class="pill-btn" href="{{ url_for('websites_page', before=next_before, limit=limit) }}">Load more</a>
+        {% endif %}
     </div>
     """
-    return render_page("websites", body, websites=websites)
+    return render_page(
+        "websites", body, websites=websites, next_before=next_before, limit=limit
+    )
 
 
 @app.route("/materials", methods=["GET", "POST"])
+@conditional("materials")
 def materials_page():
     if request.method == "POST":
         if not require_login():
@@ -1658,7 +3686,6 @@ def materials_page():
                 (user["id"], name, desc, datetime.utcnow().isoformat()),
             )
             db.commit()
-            db.close()
             flash("Material added.", "info")
         else:
             flash("Material name is required.", "error")
@@ -1666,13 +3693,14 @@ def materials_page():
 
     db = get_db()
     c = db.cursor()
+    before, limit = page_args()
     c.execute(
         "SELECT m.id, m.name, m.description, m.created_at, u.username, u.id "
         "FROM materials m JOIN users u ON u.id = m.owner_id "
-        "ORDER BY m.id DESC"
+        "WHERE m.id < ? ORDER BY m.id DESC LIMIT ?",
+        (before, limit + 1),
     )
-    materials = c.fetchall()
-    db.close()
+    materials, next_before = keyset_page(c.fetchall(), limit)
 
     body = """
     <div class="card">
@@ -1704,14 +3732,220 @@ def materials_page():
         {% else %}
             <p>No materials yet.</p>
         {% endif %}
+        {% if next_before %}
+            <a class="pill-btn" href="{{ url_for('materials_page', before=next_before, limit=limit) }}">Load more</a>
+        {% endif %}
     </div>
     """
-    return render_page("materials", body, materials=materials)
+    return render_page(
+        "materials", body, materials=materials, next_before=next_before, limit=limit
+    )
 
 
 # ---------- MESSENGER ----------
 
+MESSAGE_PREVIEW_CHARS = 80
+# Messages shown when a chat opens; older ones load as the chat scrolls up
+CHAT_PAGE_SIZE = 30
+
+CHAT_MESSAGES = """
+{% for m in messages %}
+    <div class="chat-msg {% if m[1] == user['id'] %}chat-self{% endif %}" data-id="{{ m[0] }}">
+        <span class="small">{{ m[4] }}</span><br>
+        {{ m[3] }}
+    </div>
+{% endfor %}
+"""
+
+
+def record_message(db, sender_id, receiver_id, content):
+    """
+    Inserts a message and brings both participants' conversations rows up
+    to date in the same transaction, so the inbox never has to scan
+    messages. Returns the new message id.
+    """
+    created_at = datetime.utcnow().isoformat()
+    c = db.cursor()
+    c.execute(
+        "INSERT INTO messages (sender_id, receiver_id, content, created_at) VALUES (?,?,?,?)",
+        (sender_id, receiver_id, content, created_at),
+    )
+    message_id = c.lastrowid
+    preview = content[:MESSAGE_PREVIEW_CHARS]
+    sides = [(sender_id, receiver_id, 0)]
+    if receiver_id != sender_id:
+        sides.append((receiver_id, sender_id, 1))
+    c.executemany(
+        "INSERT INTO conversations "
+        "(user_id, other_id, last_message_id, last_sender_id, last_at, preview, unread) "
+        "VALUES (?,?,?,?,?,?,?) "
+        "ON CONFLICT(user_id, other_id) DO UPDATE SET "
+        "last_message_id=excluded.last_message_id, "
+        "last_sender_id=excluded.last_sender_id, "
+        "last_at=excluded.last_at, "
+        "preview=excluded.preview, "
+        "unread=conversations.unread + excluded.unread",
+        [
+            (user_id, other_id, message_id, sender_id, created_at, preview, unread)
+            for user_id, other_id, unread in sides
+        ],
+    )
+    db.commit()
+    if MESSAGE_HUB == "local":
+        message_hub.publish(message_id, sender_id, receiver_id)
+    return message_id
+
+
+class MessageHub:
+    """
+    In-process pub/sub for new messages. Each open event stream subscribes
+    a queue for its user; publish() puts the message on the queues of both
+    participants. With poll=True a background thread follows the messages
+    table by id instead, which also picks up messages sent via other worker
+    processes. At most `max_streams` queues are subscribed at a time.
+    """
+
+    # Events buffered per stream before it is considered stuck; a stream
+    # that falls behind catches up from the history endpoint instead
+    QUEUE_SIZE = 100
+
+    def __init__(self, poll=False, interval=1.0, max_streams=None):
+        self._subscribers = {}
+        self._streams = 0
+        self._lock = threading.Lock()
+        self._poll = poll
+        self._interval = interval
+        self._max_streams = max_streams
+        self._poller = None
+
+    def subscribe(self, user_id):
+        """Returns a new queue for user_id, or None when the hub is full."""
+        q = queue.Queue(self.QUEUE_SIZE)
+        with self._lock:
+            if self._max_streams is not None and self._streams >= self._max_streams:
+                return None
+            self._subscribers.setdefault(user_id, set()).add(q)
+            self._streams += 1
+            if self._poll and self._poller is None:
+                self._poller = threading.Thread(
+                    target=self._follow_messages, name="message-hub", daemon=True
+                )
+                self._poller.start()
+        return q
+
+    def unsubscribe(self, user_id, q):
+        with self._lock:
+            queues = self._subscribers.get(user_id)
+            if queues is not None and q in queues:
+                queues.discard(q)
+                self._streams -= 1
+                if not queues:
+                    del self._subscribers[user_id]
+
+    def publish(self, message_id, sender_id, receiver_id):
+        event = {"id": message_id, "sender_id": sender_id, "receiver_id": receiver_id}
+        with self._lock:
+            targets = set()
+            for user_id in {sender_id, receiver_id}:
+                targets |= self._subscribers.get(user_id, set())
+        for q in targets:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def _follow_messages(self):
+        # The notification cursor is simply the highest message id seen
+        db = connect_db()
+        last_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+        while True:
+            time.sleep(self._interval)
+            try:
+                rows = db.execute(
+                    "SELECT id, sender_id, receiver_id FROM messages WHERE id > ? ORDER BY id",
+                    (last_id,),
+                ).fetchall()
+            except DatabaseError as exc:
+                if not is_busy_error(exc):
+                    app.logger.exception("message hub poll failed")
+                db.rollback()
+                continue
+            # Don't sit idle in a transaction between polls (PostgreSQL)
+            db.rollback()
+            for message_id, sender_id, receiver_id in rows:
+                self.publish(message_id, sender_id, receiver_id)
+                last_id = message_id
+
+
+message_hub = MessageHub(
+    poll=MESSAGE_HUB == "sqlite", interval=MESSAGE_POLL_INTERVAL, max_streams=SSE_MAX_CLIENTS
+)
+
+
+def unread_total(user_id):
+    # Streams outlive their request, so borrow a connection only briefly
+    db = db_pool.acquire()
+    try:
+        return db.execute(
+            "SELECT COALESCE(SUM(unread), 0) FROM conversations WHERE user_id=?",
+            (user_id,),
+        ).fetchone()[0]
+    finally:
+        db_pool.release(db)
+
+
+def sse_event(name, data, event_id=None):
+    lines = [f"event: {name}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def chat_messages(db, user_id, other_id, before=_NO_CURSOR, after=None, limit=CHAT_PAGE_SIZE):
+    """
+    One window of the chat between two users, oldest first, as rows of
+    (id, sender_id, receiver_id, content, created_at): the `limit` messages
+    before id `before`, or with `after` set the first `limit` after that id.
+    Each direction is read separately off idx_messages_pair so the cost
+    depends on the window, not on how long the chat is. Returns
+    (rows, more), where `more` says whether the window was cut short.
+    """
+    if after is None:
+        seek, order = "id < ?", "DESC"
+        bound = before
+    else:
+        seek, order = "id > ?", "ASC"
+        bound = after
+    one_way = (
+        "SELECT * FROM (SELECT id, sender_id, receiver_id, content, created_at "
+        f"FROM messages WHERE sender_id=? AND receiver_id=? AND {seek} "
+        f"ORDER BY id {order} LIMIT ?) AS one_way"
+    )
+    # UNION, not UNION ALL: both halves are the same rows in a chat with oneself
+    rows = db.execute(
+        f"{one_way} UNION {one_way} ORDER BY id {order} LIMIT ?",
+        (user_id, other_id, bound, limit + 1, other_id, user_id, bound, limit + 1, limit + 1),
+    ).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if after is None:
+        rows.reverse()
+    return rows, more
+
+
+def mark_read(db, user_id, other_id):
+    # Only write when there is something to clear
+    c = db.execute(
+        "UPDATE conversations SET unread=0 WHERE user_id=? AND other_id=? AND unread > 0",
+        (user_id, other_id),
+    )
+    if c.rowcount:
+        db.commit()
+
+
 @app.route("/messages")
+@conditional("conversations", "messages")
 def messages_page():
     if not require_login():
         return redirect(url_for("login_page"))
@@ -1721,37 +3955,38 @@ def messages_page():
     db = get_db()
     c = db.cursor()
 
-    c.execute(
-        "SELECT DISTINCT "
-        "CASE WHEN sender_id=? THEN receiver_id ELSE sender_id END AS other_id "
-        "FROM messages WHERE sender_id=? OR receiver_id=?",
-        (user["id"], user["id"], user["id"]),
-    )
-    ids = [row[0] for row in c.fetchall()]
-    convos = []
-    if ids:
-        q_marks = ",".join("?" for _ in ids)
-        c.execute(
-            f"SELECT id, username FROM users WHERE id IN ({q_marks})", tuple(ids)
-        )
-        convos = c.fetchall()
-
     messages = []
+    chat_html = ""
+    older_than = None
     other_user = None
     if with_user:
         c.execute("SELECT id, username FROM users WHERE id=?", (with_user,))
         other_user = c.fetchone()
         if other_user:
-            c.execute(
-                "SELECT sender_id, receiver_id, content, created_at "
-                "FROM messages "
-                "WHERE (sender_id=? AND receiver_id=?) OR (sender_id=? AND receiver_id=?) "
-                "ORDER BY id ASC",
-                (user["id"], with_user, with_user, user["id"]),
+            # Opening a chat reads it
+            mark_read(db, user["id"], with_user)
+            messages, more = chat_messages(
+                db,
+                user["id"],
+                with_user,
+                before=request.args.get("older_than", type=int) or _NO_CURSOR,
             )
-            messages = c.fetchall()
+            chat_html = render_fragment(CHAT_MESSAGES, messages=messages, user=user)
+            if more:
+                older_than = messages[0][0]
 
-    db.close()
+    # The inbox, most recent conversation first: (last_message_id, other_id,
+    # username, last_sender_id, last_at, preview, unread)
+    before, limit = page_args()
+    c.execute(
+        "SELECT cv.last_message_id, cv.other_id, u.username, cv.last_sender_id, "
+        "cv.last_at, cv.preview, cv.unread "
+        "FROM conversations AS cv JOIN users AS u ON u.id = cv.other_id "
+        "WHERE cv.user_id=? AND cv.last_message_id < ? "
+        "ORDER BY cv.last_message_id DESC LIMIT ?",
+        (user["id"], before, limit + 1),
+    )
+    convos, next_before = keyset_page(c.fetchall(), limit)
 
     body = """
     <div class="card">
@@ -1762,9 +3997,15 @@ def messages_page():
                 {% if convos %}
                     {% for c in convos %}
                         <div class="user-card">
-                            <a href="{{ url_for('messages_page', with_user=c[0]) }}">{{ c[1] }}</a>
+                            <a href="{{ url_for('messages_page', with_user=c[1]) }}">{{ c[2] }}</a>
+                            {% if c[6] %}<b>({{ c[6] }} new)</b>{% endif %}
+                            <span class="small">{{ c[4] }}</span><br>
+                            <span class="small">{% if c[3] == user['id'] %}You: {% endif %}{{ c[5] }}</span>
                         </div>
                     {% endfor %}
+                    {% if next_before %}
+                        <a class="pill-btn" href="{{ url_for('messages_page', with_user=with_user, before=next_before, limit=limit) }}">Load more</a>
+                    {% endif %}
                 {% else %}
                     <p class="small">No conversations yet.</p>
                 {% endif %}
@@ -1772,13 +4013,14 @@ def messages_page():
             <div class="half">
                 {% if other_user %}
                     <h3>Chat with {{ other_user[1] }}</h3>
-                    <div class="chat">
-                        {% for m in messages %}
-                            <div class="chat-msg {% if m[0] == user['id'] %}chat-self{% endif %}">
-                                <span class="small">{{ m[3] }}</span><br>
-                                {{ m[2] }}
-                            </div>
-                        {% endfor %}
+                    <div class="chat"
+                         data-history-url="{{ url_for('chat_history', user_id=other_user[0]) }}"
+                         data-partner-id="{{ other_user[0] }}"
+                         data-last-id="{{ messages[-1][0] if messages else 0 }}">
+                        {% if older_than %}
+                            <a class="pill-btn chat-older" href="{{ url_for('messages_page', with_user=other_user[0], older_than=older_than) }}" data-before="{{ older_than }}">Older messages</a>
+                        {% endif %}
+                        {{ chat_html }}
                         {% if not messages %}
                             <p class="small">No messages yet. Say hi!</p>
                         {% endif %}
@@ -1798,11 +4040,99 @@ def messages_page():
         "messages",
         body,
         convos=convos,
+        next_before=next_before,
+        limit=limit,
+        with_user=with_user,
         other_user=other_user,
         messages=messages,
+        chat_html=chat_html,
+        older_than=older_than,
+    )
+
+
+@app.route("/messages/<int:user_id>/history")
+@conditional("messages")
+def chat_history(user_id):
+    """
+    JSON for the chat page scripts: rendered messages with the current user
+    from before ?before= (scrolling up) or after ?after= (catching up), plus
+    the cursor for the next older page when there is one.
+    """
+    user = current_user()
+    if not user:
+        abort(401)
+
+    db = get_db()
+    after = request.args.get("after", type=int)
+    before = request.args.get("before", type=int) or _NO_CURSOR
+    messages, more = chat_messages(db, user["id"], user_id, before=before, after=after)
+    if after is not None and messages:
+        mark_read(db, user["id"], user_id)
+    return jsonify(
+        html=render_fragment(CHAT_MESSAGES, messages=messages, user=user),
+        older_than=messages[0][0] if more and after is None else None,
+        last_id=messages[-1][0] if messages else after,
+        more=more,
     )
 
 
+@app.route("/messages/stream")
+def message_stream():
+    """
+    Server-Sent Events for the logged-in user: a "message" event for every
+    message they send or receive, carrying the partner and their unread
+    total, plus an "unread" event on connect. The page scripts then fetch
+    the new messages from chat_history(). Holds no DB connection while
+    idle, but does hold a worker thread under gthread, so only the
+    Messenger pages open it and each worker serves at most SSE_MAX_CLIENTS;
+    see gunicorn.conf.py.
+    """
+    user = current_user()
+    if not user:
+        abort(401)
+    user_id = user["id"]
+
+    q = message_hub.subscribe(user_id)
+    if q is None:
+        # Full: tell the client to come back later rather than queue behind
+        # the streams already holding this worker's threads
+        rv = Response(f"retry: {SSE_BUSY_RETRY * 1000}\n\n", 503, mimetype="text/event-stream")
+        rv.headers["Retry-After"] = str(SSE_BUSY_RETRY)
+        return rv
+
+    def events():
+        # Browsers reconnect this many ms after the stream ends
+        yield "retry: 3000\n\n"
+        yield sse_event("unread", {"unread": unread_total(user_id)})
+        deadline = time.monotonic() + SSE_MAX_STREAM
+        while time.monotonic() < deadline:
+            try:
+                event = q.get(timeout=SSE_HEARTBEAT)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            partner = event["receiver_id"] if event["sender_id"] == user_id else event["sender_id"]
+            yield sse_event(
+                "message",
+                {
+                    "id": event["id"],
+                    "partner_id": partner,
+                    "incoming": event["sender_id"] != user_id,
+                    "unread": unread_total(user_id),
+                },
+                event_id=event["id"],
+            )
+
+    rv = Response(events(), mimetype="text/event-stream")
+    # Runs when the server closes the response, even if the client went
+    # away before the first event was sent
+    rv.call_on_close(lambda: message_hub.unsubscribe(user_id, q))
+    rv.headers["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream
+    rv.headers["X-Accel-Buffering"] = "no"
+    return rv
+
+
 @app.route("/messages/send/<int:user_id>", methods=["POST"])
 def send_message(user_id):
     if not require_login():
@@ -1813,14 +4143,7 @@ def send_message(user_id):
         flash("Message cannot be empty.", "error")
         return redirect(url_for("messages_page", with_user=user_id))
 
-    db = get_db()
-    c = db.cursor()
-    c.execute(
-        "INSERT INTO messages (sender_id, receiver_id, content, created_at) VALUES (?,?,?,?)",
-        (user["id"], user_id, content, datetime.utcnow().isoformat()),
-    )
-    db.commit()
-    db.close()
+    record_message(get_db(), user["id"], user_id, content)
     return redirect(url_for("messages_page", with_user=user_id))
 
 
@@ -1850,7 +4173,6 @@ def settings_page():
         (user["id"],),
     )
     s = c.fetchone()
-    db.close()
     if not s:
         s = (1, 1, 0)
 
@@ -0,0 +1,755 @@
+"""
+Benchmarks for the 3JMCO Hive app.
+
+    python bench.py db-stress [--writers 4] [--readers 4] [--seconds 5]
+    python bench.py page-weight [--posts 6]
+    python bench.py shell-size [--budget 2560]
+    python bench.py routes [--users 200 --posts 2000 ...] [--output run.json]
+                           [--baseline old.json]
+    python bench.py query-plans
+    python bench.py smoke [--database-url postgresql://...]
+
+db-stress runs parallel writer and reader processes against a scratch
+database once per DB_PROFILE and prints ops/sec and lock errors for each,
+so the rollback-journal and WAL profiles can be compared directly.
+
+page-weight uploads large photos as posts, then totals the HTML and image
+bytes of the home and profile pages with the image variant pipeline off
+and on.
+
+shell-size renders an empty page and exits non-zero if the layout shell
+(everything except the page body) is larger than the byte budget, so
+inlined CSS/JS creeping back into TEMPLATE gets noticed.
+
+routes seeds a scratch database at the given scale (bulk executemany in a
+single transaction), drives each route through the Flask test client as
+random members and reports p50/p95/p99 latency, throughput, and the SQL
+statements and DB time per request (the app's X-SQL-Count and
+Server-Timing headers) as JSON. With --baseline it also reports each
+route's p95 against an earlier --output file and exits non-zero when one
+got slower than --tolerance allows.
+
+query-plans drives every page (profile, ice can detail, inbox, chat and
+the rest) on a seeded database, runs EXPLAIN QUERY PLAN on each distinct
+statement they issue and exits non-zero if any of them scans a table
+instead of using an index.
+
+smoke walks every route as two members and an anonymous visitor (sign up,
+post with an upload, ice cans, follows, messages, chat history, the event
+stream, search, settings, fragments and ETags) on a scratch SQLite
+database and, with --database-url, on a scratch database created on that
+PostgreSQL server, checks what each page shows and that the counters
+reconcile, and exits non-zero on any failure.
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def _load_app(db_path, profile, **env):
+    # app reads its configuration from the environment at import time
+    os.environ["DATABASE_PATH"] = db_path
+    os.environ["DB_PROFILE"] = profile
+    os.environ.update(env)
+    import app
+
+    return app
+
+
+def _stress_worker(role, db_path, profile, seconds, results):
+    app = _load_app(db_path, profile)
+    db = app.connect_db()
+    ops = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            if role == "writer":
+                db.execute(
+                    "INSERT INTO messages (sender_id, receiver_id, content, created_at) "
+                    "VALUES (?,?,?,?)",
+                    (1, 2, "stress", "2024-01-01T00:00:00"),
+                )
+                db.commit()
+            else:
+                db.execute(
+                    "SELECT sender_id, receiver_id, content, created_at FROM messages "
+                    "WHERE (sender_id=? AND receiver_id=?) OR (sender_id=? AND receiver_id=?) "
+                    "ORDER BY id DESC LIMIT 50",
+                    (1, 2, 2, 1),
+                ).fetchall()
+            ops += 1
+        except sqlite3.OperationalError as exc:
+            if not app.is_busy_error(exc):
+                raise
+            if db.in_transaction:
+                db.rollback()
+            errors += 1
+    db.close()
+    results.put((role, ops, errors))
+
+
+def run_db_stress(profile, writers, readers, seconds):
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "stress.db")
+        # Create the schema once before the workers race for it
+        setup = ctx.Process(target=_load_app, args=(db_path, profile))
+        setup.start()
+        setup.join()
+
+        results = ctx.Queue()
+        procs = [
+            ctx.Process(
+                target=_stress_worker,
+                args=(role, db_path, profile, seconds, results),
+            )
+            for role in ["writer"] * writers + ["reader"] * readers
+        ]
+        for p in procs:
+            p.start()
+        totals = {"writer": [0, 0], "reader": [0, 0]}
+        for _ in procs:
+            role, ops, errors = results.get()
+            totals[role][0] += ops
+            totals[role][1] += errors
+        for p in procs:
+            p.join()
+
+    return {
+        "profile": profile,
+        "writes_per_sec": round(totals["writer"][0] / seconds, 1),
+        "reads_per_sec": round(totals["reader"][0] / seconds, 1),
+        "write_lock_errors": totals["writer"][1],
+        "read_lock_errors": totals["reader"][1],
+    }
+
+
+def cmd_db_stress(args):
+    # app is only ever imported in child processes, each with its own config
+    profiles = args.profile or ["default", "performance"]
+    report = [
+        run_db_stress(profile, args.writers, args.readers, args.seconds)
+        for profile in profiles
+    ]
+    print(json.dumps(report, indent=2))
+
+
+def _sample_photo(seed, size=(2400, 1600)):
+    from PIL import Image
+
+    # Noise keeps the JPEG large, like a real phone photo
+    bands = [Image.effect_noise(size, 40 + 10 * (seed + i)) for i in range(3)]
+    buf = io.BytesIO()
+    Image.merge("RGB", bands).save(buf, "JPEG", quality=90)
+    buf.seek(0)
+    return buf
+
+
+def _page_weight_worker(tmp, pipeline, posts, results):
+    app = _load_app(
+        os.path.join(tmp, f"weight-{pipeline}.db"),
+        "performance",
+        UPLOAD_FOLDER=os.path.join(tmp, f"uploads-{pipeline}"),
+        IMAGE_PIPELINE=pipeline,
+    )
+    client = app.app.test_client()
+    client.post("/register", data={"username": "bench", "password": "pw"})
+    for n in range(posts):
+        client.post(
+            "/posts/create",
+            data={"content": f"photo {n}", "image_file": (_sample_photo(n), f"{n}.jpg")},
+            content_type="multipart/form-data",
+        )
+    app.image_executor.shutdown(wait=True)
+    with client.session_transaction() as sess:
+        sess["intro_seen"] = True
+
+    pages = {}
+    for url in ("/", "/profile/1"):
+        html = client.get(url).data
+        images = 0
+        for src in re.findall(rb'<img src="(/uploads/[^"]+)"', html):
+            rv = client.get(src.decode(), follow_redirects=True)
+            images += len(rv.data)
+        pages[url] = {"html_bytes": len(html), "image_bytes": images}
+    results.put((pipeline, pages))
+
+
+def cmd_page_weight(args):
+    ctx = multiprocessing.get_context("spawn")
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        results = ctx.Queue()
+        for pipeline in ("0", "1"):
+            proc = ctx.Process(
+                target=_page_weight_worker, args=(tmp, pipeline, args.posts, results)
+            )
+            proc.start()
+            key, pages = results.get()
+            proc.join()
+            report["variants" if key == "1" else "originals"] = pages
+
+    for url, after in report["variants"].items():
+        before = report["originals"][url]
+        total_before = before["html_bytes"] + before["image_bytes"]
+        total_after = after["html_bytes"] + after["image_bytes"]
+        after["reduction"] = round(1 - total_after / total_before, 3) if total_before else 0
+    print(json.dumps(report, indent=2))
+
+
+# Bytes the layout shell may take up; with CSS/JS in static bundles it is
+# about 1.7 KB (it was over 12 KB with them inlined)
+SHELL_BUDGET = 2560
+
+
+def _shell_size_worker(tmp, results):
+    app = _load_app(os.path.join(tmp, "shell.db"), "performance")
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess["intro_seen"] = True
+    html = client.get("/owners").data.decode("utf-8")
+    # The /owners body on an empty database is a single card
+    start = html.index('<div class="card">')
+    end = html.index("</div>", html.index("No owners yet.")) + len("</div>")
+    results.put((len(html.encode("utf-8")), len(html[start:end].encode("utf-8"))))
+
+
+def cmd_shell_size(args):
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        results = ctx.Queue()
+        proc = ctx.Process(target=_shell_size_worker, args=(tmp, results))
+        proc.start()
+        total, body = results.get()
+        proc.join()
+
+    shell = total - body
+    print(json.dumps({"page_bytes": total, "shell_bytes": shell, "budget": args.budget}))
+    if shell > args.budget:
+        print(f"layout shell is {shell} bytes, over the {args.budget} byte budget", file=sys.stderr)
+        sys.exit(1)
+
+
+SEED_WORDS = (
+    "stainless steel ice can tank brine cooling plant block mold frame "
+    "welding fabrication coil pump repair quote delivery capacity"
+).split()
+
+
+def _words(rng, n):
+    return " ".join(rng.choice(SEED_WORDS) for _ in range(n))
+
+
+def seed_db(app, db, scale, seed=1):
+    """
+    Fills an empty database at `scale` (a dict of row counts; follows and
+    interested are per user) in one transaction, derived tables included,
+    and returns the number of rows written.
+    """
+    rng = random.Random(seed)
+    clock = iter(range(10 ** 9))
+    start = datetime(2024, 1, 1)
+
+    def stamp():
+        return (start + timedelta(minutes=next(clock))).isoformat()
+
+    def others(uid, k):
+        # Sample one extra so dropping the member themself still leaves k
+        picked = rng.sample(user_ids, min(k + 1, n_users))
+        return [o for o in picked if o != uid][:k]
+
+    n_users = scale["users"]
+    user_ids = range(1, n_users + 1)
+    rows = {
+        "users": [
+            (uid, f"member{uid}", "pw", _words(rng, 1).title(), _words(rng, 12), stamp())
+            for uid in user_ids
+        ],
+        "settings": [(uid, 1, 1, 0) for uid in user_ids],
+        "icecans": [
+            (rng.choice(user_ids), _words(rng, 3).title(), _words(rng, 30), _words(rng, 1).title(),
+             f"{rng.randint(1, 200)} blocks", stamp())
+            for _ in range(scale["icecans"])
+        ],
+        "posts": [
+            (rng.choice(user_ids), _words(rng, 25), "", stamp()) for _ in range(scale["posts"])
+        ],
+        "follows": [
+            (uid, other, stamp())
+            for uid in user_ids
+            for other in others(uid, scale["follows"])
+        ],
+        "interested": [
+            (uid, icecan, stamp())
+            for uid in user_ids
+            for icecan in rng.sample(range(1, scale["icecans"] + 1), min(scale["interested"], scale["icecans"]))
+        ],
+        # Messages cluster on a few partners per member, so threads get long
+        "messages": [],
+    }
+    partners = {uid: rng.sample(user_ids, min(5, n_users)) for uid in user_ids}
+    for _ in range(scale["messages"]):
+        sender = rng.choice(user_ids)
+        rows["messages"].append((sender, rng.choice(partners[sender]), _words(rng, 8), stamp()))
+
+    inserts = {
+        "users": "INSERT INTO users (id, username, password, location, bio, created_at) VALUES (?,?,?,?,?,?)",
+        "settings": "INSERT INTO settings (user_id, show_contact, allow_messages, dark_theme) VALUES (?,?,?,?)",
+        "icecans": "INSERT INTO icecans (owner_id, title, description, location, capacity, created_at) "
+        "VALUES (?,?,?,?,?,?)",
+        "posts": "INSERT INTO posts (owner_id, content, image_url, created_at) VALUES (?,?,?,?)",
+        "follows": "INSERT INTO follows (follower_id, followed_id, created_at) VALUES (?,?,?)",
+        "interested": "INSERT INTO interested (user_id, icecan_id, created_at) VALUES (?,?,?)",
+        "messages": "INSERT INTO messages (sender_id, receiver_id, content, created_at) VALUES (?,?,?,?)",
+    }
+    for table, sql in inserts.items():
+        db.executemany(sql, rows[table])
+
+    # What the app would have built up through its own write paths
+    for name, sql in app.COUNTER_SOURCES.items():
+        db.execute(f"INSERT INTO counters (name, id, value) SELECT '{name}', * FROM ({sql})")
+    db.execute(
+        "INSERT INTO conversations "
+        "(user_id, other_id, last_message_id, last_sender_id, last_at, preview) "
+        "SELECT p.user_id, p.other_id, m.id, m.sender_id, m.created_at, substr(m.content, 1, ?) "
+        "FROM (SELECT user_id, other_id, MAX(id) AS last_id FROM ("
+        "SELECT sender_id AS user_id, receiver_id AS other_id, id FROM messages "
+        "UNION ALL SELECT receiver_id, sender_id, id FROM messages) "
+        "GROUP BY user_id, other_id) AS p JOIN messages AS m ON m.id = p.last_id",
+        (app.MESSAGE_PREVIEW_CHARS,),
+    )
+    db.execute(
+        "INSERT INTO activities (kind, item_id, author_id, created_at, pushed) "
+        "SELECT kind, id, owner_id, created_at, 1 FROM ("
+        "SELECT 'post' AS kind, id, owner_id, created_at FROM posts "
+        "UNION ALL SELECT 'icecan', id, owner_id, created_at FROM icecans) "
+        "ORDER BY created_at, kind, id"
+    )
+    db.execute(
+        "INSERT INTO timeline (user_id, activity_id) "
+        "SELECT f.follower_id, a.id FROM activities AS a "
+        "JOIN follows AS f ON f.followed_id = a.author_id"
+    )
+    db.commit()
+    return sum(len(r) for r in rows.values())
+
+
+def _percentile(sorted_ms, pct):
+    # Nearest-rank percentile
+    index = max(0, -(-len(sorted_ms) * pct // 100) - 1)
+    return round(sorted_ms[int(index)], 2)
+
+
+def _route_plan(scale, rng):
+    """(label, method, url factory, form factory) for every benchmarked route."""
+    users = scale["users"]
+    icecans = scale["icecans"]
+
+    def member():
+        return rng.randint(1, users)
+
+    return [
+        ("GET /", "GET", lambda: "/", None),
+        ("GET /search", "GET", lambda: f"/search?q={rng.choice(SEED_WORDS)}", None),
+        ("GET /profile/<id>", "GET", lambda: f"/profile/{member()}", None),
+        ("GET /icecans", "GET", lambda: "/icecans", None),
+        ("GET /icecans/<id>", "GET", lambda: f"/icecans/{rng.randint(1, icecans)}", None),
+        ("GET /messages", "GET", lambda: "/messages", None),
+        ("GET /messages?with_user", "GET", lambda: f"/messages?with_user={member()}", None),
+        ("POST /posts/create", "POST", lambda: "/posts/create", lambda: {"content": _words(rng, 20)}),
+        ("POST /messages/send/<id>", "POST", lambda: f"/messages/send/{member()}",
+         lambda: {"content": _words(rng, 8)}),
+        ("POST /follow/<id>", "POST", lambda: f"/follow/{member()}", lambda: {}),
+        ("POST /icecans/<id>/interested", "POST",
+         lambda: f"/icecans/{rng.randint(1, icecans)}/interested", lambda: {}),
+    ]
+
+
+def _routes_worker(tmp, scale, requests, results):
+    app = _load_app(
+        os.path.join(tmp, "routes.db"),
+        "performance",
+        UPLOAD_FOLDER=os.path.join(tmp, "uploads"),
+        IMAGE_PIPELINE="0",
+        SQL_STATS="1",
+    )
+    db = app.connect_db()
+    started = time.perf_counter()
+    seeded = seed_db(app, db, scale)
+    seed_seconds = time.perf_counter() - started
+    db.close()
+
+    rng = random.Random(2)
+    client = app.app.test_client()
+    report = {}
+    for label, method, url, form in _route_plan(scale, rng):
+        timings = []
+        statements = 0
+        db_ms = 0.0
+        for _ in range(requests):
+            with client.session_transaction() as sess:
+                sess["user_id"] = rng.randint(1, scale["users"])
+                sess["intro_seen"] = True
+            target = url()
+            t0 = time.perf_counter()
+            if method == "GET":
+                rv = client.get(target)
+            else:
+                rv = client.post(target, data=form())
+            timings.append((time.perf_counter() - t0) * 1000)
+            # Per-request SQL accounting from the app's own headers
+            statements += int(rv.headers.get("X-SQL-Count", 0))
+            timing = re.search(r"db;dur=([\d.]+)", rv.headers.get("Server-Timing", ""))
+            db_ms += float(timing.group(1)) if timing else 0.0
+            if rv.status_code >= 400:
+                raise RuntimeError(f"{method} {target} returned {rv.status_code}")
+        timings.sort()
+        report[label] = {
+            "requests": requests,
+            "p50_ms": _percentile(timings, 50),
+            "p95_ms": _percentile(timings, 95),
+            "p99_ms": _percentile(timings, 99),
+            "rps": round(requests / (sum(timings) / 1000), 1),
+            "queries_per_request": round(statements / requests, 2),
+            "db_ms_per_request": round(db_ms / requests, 3),
+        }
+    app.timeline_executor.shutdown(wait=True)
+    results.put({"seeded_rows": seeded, "seed_seconds": round(seed_seconds, 2), "routes": report})
+
+
+def cmd_routes(args):
+    scale = {
+        "users": args.users,
+        "icecans": args.icecans,
+        "posts": args.posts,
+        "follows": args.follows,
+        "interested": args.interested,
+        "messages": args.messages,
+    }
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        results = ctx.Queue()
+        proc = ctx.Process(target=_routes_worker, args=(tmp, scale, args.requests, results))
+        proc.start()
+        run = results.get()
+        proc.join()
+    run = {"scale": scale, **run}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for label, stats in run["routes"].items():
+            before = baseline.get("routes", {}).get(label)
+            if not before:
+                continue
+            ratio = stats["p95_ms"] / before["p95_ms"] if before["p95_ms"] else 1.0
+            stats["p95_vs_baseline"] = round(ratio, 2)
+            if ratio > 1 + args.tolerance:
+                regressions.append(label)
+        run["regressions"] = regressions
+
+    text = json.dumps(run, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    if regressions:
+        print(f"p95 regressed on: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+# Plan lines that read a whole table; FTS lookups and scans of a query's
+# own subqueries/CTEs are fine
+_TABLE_SCAN = re.compile(r"^SCAN (\w+)(?!\w| VIRTUAL TABLE)")
+_SUBQUERY = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (\w+)")
+# "Newest N" with no filter walks the rowid backwards and stops at LIMIT
+_NEWEST_N = re.compile(r"ORDER BY (?:\w+\.)?id DESC LIMIT", re.IGNORECASE)
+# A keyset seek on the rowid alone, while the statement also filters on a
+# column (owner_id=?), reads every row past the cursor: a scan in disguise
+_ROWID_RANGE = re.compile(r"^SEARCH \w+ USING INTEGER PRIMARY KEY \(rowid[<>]\?\)$")
+_COLUMN_FILTER = re.compile(r"\b(?!id\b)\w+\s*=\s*\?")
+
+
+def _scans_table(sql, details):
+    if " WHERE " not in sql.upper() and _NEWEST_N.search(sql) and not any(
+        d.startswith("USE TEMP B-TREE") for d in details
+    ):
+        return False
+    if _COLUMN_FILTER.search(sql) and any(map(_ROWID_RANGE.match, details)):
+        return True
+    subqueries = {m.group(1) for m in map(_SUBQUERY.match, details) if m}
+    return any((m := _TABLE_SCAN.match(d)) and m.group(1) not in subqueries for d in details)
+
+
+def _query_plans_worker(tmp, scale, results):
+    app = _load_app(
+        os.path.join(tmp, "plans.db"),
+        "performance",
+        UPLOAD_FOLDER=os.path.join(tmp, "uploads"),
+        IMAGE_PIPELINE="0",
+        SQL_STATS="1",
+    )
+    db = app.connect_db()
+    seed_db(app, db, scale)
+
+    # Registered after the app's own hooks, so it runs before
+    # report_queries takes the request's statements off g
+    statements = {}
+
+    @app.app.after_request
+    def capture(response):
+        for sql, parameters, _ in app.g.get("sql_log", ()):
+            statements.setdefault(sql, (app.request.path, parameters))
+        return response
+
+    rng = random.Random(3)
+    plan = _route_plan(scale, rng) + [
+        ("GET /owners", "GET", lambda: "/owners", None),
+        ("GET /websites", "GET", lambda: "/websites", None),
+        ("GET /materials", "GET", lambda: "/materials", None),
+        ("GET /settings", "GET", lambda: "/settings", None),
+        ("GET /messages/<id>/history", "GET",
+         lambda: f"/messages/{rng.randint(2, scale['users'])}/history?before=1000000", None),
+        ("GET /messages/<id>/history?after", "GET",
+         lambda: f"/messages/{rng.randint(2, scale['users'])}/history?after=1", None),
+    ]
+    client = app.app.test_client()
+    for _, method, url, form in plan:
+        with client.session_transaction() as sess:
+            sess["user_id"] = 1
+            sess["intro_seen"] = True
+        target = url()
+        rv = client.get(target) if method == "GET" else client.post(target, data=form())
+        if rv.status_code >= 400:
+            raise RuntimeError(f"{method} {target} returned {rv.status_code}")
+    app.timeline_executor.shutdown(wait=True)
+
+    scans = []
+    for sql, (path, parameters) in statements.items():
+        # executemany() batches (parameters None) have no single plan input
+        if parameters is None or not app._EXPLAINABLE.match(sql):
+            continue
+        details = [row[3] for row in db.execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+        if _scans_table(sql, details):
+            scans.append({"path": path, "sql": " ".join(sql.split()), "plan": details})
+    db.close()
+    results.put({"statements": len(statements), "table_scans": scans})
+
+
+def cmd_query_plans(args):
+    scale = {
+        "users": args.users,
+        "icecans": args.icecans,
+        "posts": args.posts,
+        "follows": args.follows,
+        "interested": args.interested,
+        "messages": args.messages,
+    }
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        results = ctx.Queue()
+        proc = ctx.Process(target=_query_plans_worker, args=(tmp, scale, results))
+        proc.start()
+        run = results.get()
+        proc.join()
+
+    print(json.dumps(run, indent=2))
+    if run["table_scans"]:
+        print(f"{len(run['table_scans'])} statements scan a table", file=sys.stderr)
+        sys.exit(1)
+
+
+def _smoke_png():
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\x89PNG not really"
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 32), (40, 120, 200)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _smoke_worker(tmp, database_url, results):
+    env = {
+        "UPLOAD_FOLDER": os.path.join(tmp, "uploads"),
+        "IMAGE_PIPELINE": "0",
+        "MESSAGE_HUB": "local",
+        # Let /messages/stream end on its own after the first events
+        "SSE_MAX_STREAM": "0.2",
+        "SSE_HEARTBEAT": "0.1",
+        "SQL_SLOW_MS": "1000",
+    }
+    if database_url:
+        env.update(DB_ENGINE="postgres", DATABASE_URL=database_url)
+    app = _load_app(os.path.join(tmp, "smoke.db"), "performance", **env)
+    failures = []
+    count = [0]
+
+    def check(client, method, url, status=(200,), contains=(), **kwargs):
+        count[0] += 1
+        rv = client.open(url, method=method, **kwargs)
+        body = rv.get_data()
+        if rv.status_code not in status:
+            failures.append(f"{method} {url}: status {rv.status_code}")
+        for text in contains:
+            if text.encode("utf-8") not in body:
+                failures.append(f"{method} {url}: no {text!r}")
+        return rv
+
+    anon, alice, bob = (app.app.test_client() for _ in range(3))
+    redirect = (302,)
+
+    check(anon, "GET", "/", redirect)
+    check(anon, "GET", "/intro")
+    check(anon, "GET", "/auth", contains=["Register"])
+    for client, name in ((alice, "alice"), (bob, "bob")):
+        check(client, "POST", "/register", redirect, data={"username": name, "password": "pw", "location": "Manila"})
+    check(bob, "GET", "/logout", redirect)
+    check(bob, "POST", "/login", redirect, data={"username": "bob", "password": "pw"})
+    for client in (alice, bob):
+        with client.session_transaction() as sess:
+            sess["intro_seen"] = True
+
+    check(alice, "POST", "/posts/create", redirect, content_type="multipart/form-data",
+          data={"content": "steel brine tank rebuilt", "image_file": (io.BytesIO(_smoke_png()), "tank.png")})
+    check(alice, "POST", "/icecans/create", redirect,
+          data={"title": "Brine tank 5t", "description": "stainless", "location": "Cebu", "capacity": "40 blocks"})
+    check(alice, "POST", "/websites", redirect, data={"url": "https://example.com", "description": "shop"})
+    check(alice, "POST", "/materials", redirect, data={"name": "coil", "description": "copper"})
+    check(bob, "POST", "/follow/1", redirect)
+    check(bob, "POST", "/icecans/1/interested", redirect)
+    check(bob, "POST", "/messages/send/1", redirect, data={"content": "hello alice"})
+    check(alice, "POST", "/messages/send/2", redirect, data={"content": "hi bob"})
+    check(bob, "POST", "/settings", (200, 302), data={"show_contact": "on", "allow_messages": "on"})
+
+    check(bob, "GET", "/", contains=["steel brine tank rebuilt", "Brine tank 5t"])
+    check(anon, "GET", "/icecans", contains=["Brine tank 5t"])
+    check(bob, "GET", "/icecans/1", contains=["Brine tank 5t", "bob"])
+    check(anon, "GET", "/owners", contains=["alice", "bob"])
+    profile = check(anon, "GET", "/profile/1", contains=["Followers: 1", "https://example.com", "coil"])
+    check(anon, "GET", "/profile/2", contains=["Following: 1"])
+    check(alice, "GET", "/websites", contains=["https://example.com"])
+    check(alice, "GET", "/materials", contains=["coil"])
+    check(alice, "GET", "/messages", contains=["bob", "hi bob"])
+    check(alice, "GET", "/messages?with_user=2", contains=["hello alice", "hi bob"])
+    check(alice, "GET", "/messages?with_user=2&older_than=1000000", contains=["hello alice"])
+    check(bob, "GET", "/messages/1/history?before=1000000", contains=["hello alice"])
+    check(bob, "GET", "/messages/1/history?after=0", contains=["hi bob"])
+    check(alice, "GET", "/messages/stream", contains=["event: unread"])
+    check(alice, "GET", "/search?q=brine", contains=["<mark>Brine</mark> tank 5t", "steel"])
+    check(bob, "GET", "/settings")
+    check(anon, "GET", "/metrics", (200, 404))
+
+    upload = re.search(r"/uploads/[\w/.-]+", profile.get_data(as_text=True))
+    if upload:
+        check(anon, "GET", upload.group(0))
+    else:
+        failures.append("GET /profile/1: no uploaded image")
+    check(anon, "GET", "/owners", contains=['"html"'], headers={"X-Hive-Fragment": "1"})
+    etag = check(anon, "GET", "/owners").headers.get("ETag", "")
+    check(anon, "GET", "/owners", (304,), headers={"If-None-Match": etag})
+
+    app.timeline_executor.shutdown(wait=True)
+    with app.app.app_context():
+        wrong = app.reconcile_counters(app.get_db())
+    if wrong:
+        failures.append(f"{wrong} counters did not match their source tables")
+    results.put({"requests": count[0], "failures": failures})
+
+
+def _smoke_run(engine, database_url=None):
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        results = ctx.Queue()
+        proc = ctx.Process(target=_smoke_worker, args=(tmp, database_url, results))
+        proc.start()
+        proc.join()
+        run = results.get() if proc.exitcode == 0 else {"failures": [f"exited with {proc.exitcode}"]}
+    return {"engine": engine, **run}
+
+
+def cmd_smoke(args):
+    runs = [_smoke_run("sqlite")]
+    if args.database_url:
+        # A throwaway database on the given server, so the run starts empty
+        import psycopg2.extensions
+
+        name = f"hive_smoke_{os.getpid()}"
+        admin = psycopg2.connect(args.database_url)
+        admin.autocommit = True
+        admin.cursor().execute(f"CREATE DATABASE {name}")
+        try:
+            runs.append(_smoke_run("postgres", psycopg2.extensions.make_dsn(args.database_url, dbname=name)))
+        finally:
+            admin.cursor().execute(f"DROP DATABASE {name} WITH (FORCE)")
+            admin.close()
+
+    print(json.dumps(runs, indent=2))
+    failed = [run["engine"] for run in runs if run["failures"]]
+    if failed:
+        print(f"smoke failed on: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    stress = sub.add_parser("db-stress", help="parallel SQLite writers/readers per profile")
+    stress.add_argument("--writers", type=int, default=4)
+    stress.add_argument("--readers", type=int, default=4)
+    stress.add_argument("--seconds", type=float, default=5.0)
+    stress.add_argument("--profile", action="append", help="profile to run (repeatable)")
+    stress.set_defaults(func=cmd_db_stress)
+
+    weight = sub.add_parser("page-weight", help="page bytes with/without image variants")
+    weight.add_argument("--posts", type=int, default=6)
+    weight.set_defaults(func=cmd_page_weight)
+
+    shell = sub.add_parser("shell-size", help="fail if the layout shell grows past a budget")
+    shell.add_argument("--budget", type=int, default=SHELL_BUDGET)
+    shell.set_defaults(func=cmd_shell_size)
+
+    routes = sub.add_parser("routes", help="per-route latency on a seeded database")
+    routes.add_argument("--users", type=int, default=200)
+    routes.add_argument("--icecans", type=int, default=400)
+    routes.add_argument("--posts", type=int, default=2000)
+    routes.add_argument("--follows", type=int, default=10, help="per user")
+    routes.add_argument("--interested", type=int, default=3, help="per user")
+    routes.add_argument("--messages", type=int, default=5000)
+    routes.add_argument("--requests", type=int, default=100, help="per route")
+    routes.add_argument("--output", help="also write the JSON report here")
+    routes.add_argument("--baseline", help="earlier --output file to compare p95 against")
+    routes.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown")
+    routes.set_defaults(func=cmd_routes)
+
+    plans = sub.add_parser("query-plans", help="fail if a page's SQL scans a table")
+    plans.add_argument("--users", type=int, default=50)
+    plans.add_argument("--icecans", type=int, default=100)
+    plans.add_argument("--posts", type=int, default=200)
+    plans.add_argument("--follows", type=int, default=10, help="per user")
+    plans.add_argument("--interested", type=int, default=3, help="per user")
+    plans.add_argument("--messages", type=int, default=500)
+    plans.set_defaults(func=cmd_query_plans)
+
+    smoke = sub.add_parser("smoke", help="every route on SQLite (and PostgreSQL)")
+    smoke.add_argument("--database-url", help="PostgreSQL server to also run against")
+    smoke.set_defaults(func=cmd_smoke)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
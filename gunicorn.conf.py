@@ -0,0 +1,75 @@
+"""
+gunicorn settings; gunicorn reads this file from the working directory.
+
+The default "gthread" worker class spends one of its GUNICORN_THREADS on
+each open /messages/stream, so SSE_MAX_CLIENTS defaults to a quarter of the
+threads and further Messenger tabs are told to retry later; streams can't
+starve page requests.
+
+gevent (pip install gevent, GUNICORN_WORKER_CLASS=gevent) serves each
+stream as a greenlet, so a worker holds thousands of them, but it is
+opt-in: SQLite's busy wait and Pillow's resizes block in C without
+yielding, so under gevent one write-lock wait or one image resize stalls
+every request on the worker. Use it only with DB_ENGINE=postgres and
+IMAGE_PIPELINE=0, or as a separate gunicorn that the proxy sends only
+/messages/stream to (with MESSAGE_HUB=sqlite, see below).
+
+With more than one worker (WEB_CONCURRENCY), also set MESSAGE_HUB=sqlite so
+streams hear about messages sent through other workers.
+
+Workers write their Prometheus samples under PROMETHEUS_MULTIPROC_DIR so
+/metrics on any worker reports totals for the whole server. Its *.db sample
+files are deleted when gunicorn starts (nothing else in it is touched), and
+a worker's in-flight gauge is dropped when it exits.
+"""
+
+import glob
+import os
+import tempfile
+
+# Set here, in the master, so every worker inherits it before it imports
+# prometheus_client
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "hive-metrics")
+)
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+# Open connections per worker for the async (gevent/eventlet) classes
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "2000"))
+
+# Event streams per worker (read by app.py); under gthread leave most
+# threads for page requests
+if worker_class == "gthread":
+    os.environ.setdefault("SSE_MAX_CLIENTS", str(max(1, threads // 4)))
+else:
+    os.environ.setdefault("SSE_MAX_CLIENTS", str(worker_connections // 2))
+
+
+def on_starting(server):
+    # The directory may be one the operator chose, so only clear out the
+    # samples left by the previous run
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid, metrics_dir)
+
+
+def post_worker_init(worker):
+    # psycopg2 waits on the socket in C, which would block every greenlet of
+    # a gevent worker; wait through the (monkey-patched) select instead
+    if worker_class == "gevent" and os.environ.get("DB_ENGINE") == "postgres":
+        import psycopg2.extensions
+        import psycopg2.extras
+
+        psycopg2.extensions.set_wait_callback(psycopg2.extras.wait_select)
@@ -0,0 +1,401 @@
+// 3JMCO Hive page scripts. Built into static/dist by `flask --app app build-assets`.
+
+function togglePassword(fieldId, toggleId) {
+    const field = document.getElementById(fieldId);
+    const toggle = document.getElementById(toggleId);
+    if (!field) return;
+
+    if (field.type === "password") {
+        field.type = "text";
+        if (toggle) toggle.textContent = "Hide";
+    } else {
+        field.type = "password";
+        if (toggle) toggle.textContent = "Show";
+    }
+}
+
+// Time-to-next-page: from the click on a nav link to the new body being on
+// screen. Navigations slower than this are reported in the console.
+const NAV_TARGET_MS = 300;
+const NAV_START_KEY = "hive-nav-start";
+
+// Hovering a link this long counts as intent and prefetches it
+const PREFETCH_HOVER_MS = 65;
+
+// In-app navigation asks for just the page body with this header, see
+// render_page() in app.py. Prefetched bodies are used for this long.
+const FRAGMENT_HEADER = "X-Hive-Fragment";
+const PREFETCH_TTL_MS = 10000;
+
+function fetchFragment(url) {
+    const headers = {};
+    headers[FRAGMENT_HEADER] = "1";
+    return fetch(url, { headers: headers, credentials: "same-origin" }).then(function (resp) {
+        // Anything else (an error, a page without a body fragment such as
+        // the intro) is left to a normal page load
+        const type = resp.headers.get("Content-Type") || "";
+        if (!resp.ok || type.indexOf("application/json") === -1) {
+            throw new Error("no fragment for " + url);
+        }
+        return resp.json().then(function (data) {
+            data.url = resp.url;
+            return data;
+        });
+    });
+}
+
+function reportNavigationTime() {
+    let start = 0;
+    try {
+        start = Number(sessionStorage.getItem(NAV_START_KEY));
+        sessionStorage.removeItem(NAV_START_KEY);
+    } catch (err) {
+        return;
+    }
+    if (!start) return;
+
+    const ms = Date.now() - start;
+    window.hiveLastNavigationMs = ms;
+    if (ms > NAV_TARGET_MS) {
+        console.warn("time-to-next-page " + ms + " ms (target " + NAV_TARGET_MS + " ms)");
+    }
+}
+
+// Chat history loads in windows, see chat_history() in app.py. Scrolling
+// within this many pixels of the top fetches the next older window.
+const CHAT_SCROLL_THRESHOLD = 40;
+
+function initChat() {
+    const chat = document.querySelector(".chat[data-history-url]");
+    if (!chat || chat.dataset.ready) return;
+    chat.dataset.ready = "1";
+
+    const historyUrl = chat.dataset.historyUrl;
+    let loading = false;
+
+    function load(params) {
+        loading = true;
+        return fetch(historyUrl + "?" + params, { credentials: "same-origin" })
+            .then(function (resp) {
+                if (!resp.ok) throw new Error("chat history " + resp.status);
+                return resp.json();
+            })
+            .finally(function () {
+                loading = false;
+            });
+    }
+
+    function loadOlder() {
+        const olderLink = chat.querySelector(".chat-older");
+        if (loading || !olderLink) return;
+        load("before=" + olderLink.dataset.before).then(function (data) {
+            // Keep the message under the reader's eyes where it was
+            const fromBottom = chat.scrollHeight - chat.scrollTop;
+            olderLink.insertAdjacentHTML("afterend", data.html);
+            if (data.older_than) {
+                olderLink.dataset.before = data.older_than;
+                olderLink.href = olderLink.href.replace(/older_than=\d+/, "older_than=" + data.older_than);
+            } else {
+                olderLink.remove();
+            }
+            chat.scrollTop = chat.scrollHeight - fromBottom;
+        }).catch(function () {});
+    }
+
+    function loadNewer() {
+        if (loading) return;
+        load("after=" + (chat.dataset.lastId || 0)).then(function (data) {
+            if (!data.html.trim()) return;
+            const atBottom = chat.scrollHeight - chat.scrollTop - chat.clientHeight < CHAT_SCROLL_THRESHOLD;
+            const empty = chat.querySelector("p.small");
+            if (empty) empty.remove();
+            chat.insertAdjacentHTML("beforeend", data.html);
+            chat.dataset.lastId = data.last_id;
+            if (atBottom) chat.scrollTop = chat.scrollHeight;
+            if (data.more) loadNewer();
+        }).catch(function () {});
+    }
+
+    chat.scrollTop = chat.scrollHeight;
+    chat.addEventListener("scroll", function () {
+        if (chat.scrollTop < CHAT_SCROLL_THRESHOLD) loadOlder();
+    });
+    const olderLink = chat.querySelector(".chat-older");
+    if (olderLink) {
+        olderLink.addEventListener("click", function (e) {
+            e.preventDefault();
+            loadOlder();
+        });
+    }
+    chat.hiveLoadNewer = loadNewer;
+}
+
+document.addEventListener("hive:page", initChat);
+
+// New messages and unread counts arrive as Server-Sent Events, see
+// message_stream() in app.py. Only the Messenger pages keep a stream open,
+// since each one holds a server thread; a stream the server refuses (full)
+// is retried with backoff, starting at its SSE_BUSY_RETRY.
+const STREAM_RETRY_MS = 30000;
+const STREAM_RETRY_MAX_MS = 300000;
+let messageStream = null;
+let streamRetry = null;
+let streamDelay = STREAM_RETRY_MS;
+
+function showUnread(count) {
+    const link = document.querySelector(".nav a[data-tab='messages']");
+    if (!link) return;
+    if (!link.dataset.label) link.dataset.label = link.textContent;
+    link.textContent = count ? link.dataset.label + " (" + count + ")" : link.dataset.label;
+}
+
+function closeMessageStream() {
+    if (messageStream) messageStream.close();
+    messageStream = null;
+    clearTimeout(streamRetry);
+    streamRetry = null;
+}
+
+function syncMessageStream() {
+    const url = document.body.dataset.streamUrl;
+    const onMessenger = document.querySelector(".nav a[data-tab='messages'].active");
+    if (!url || !document.body.dataset.userId || !window.EventSource || !onMessenger) {
+        closeMessageStream();
+        return;
+    }
+    if (messageStream || streamRetry) return;
+
+    function openChat() {
+        return document.querySelector(".chat[data-history-url]");
+    }
+
+    const stream = new EventSource(url);
+    messageStream = stream;
+    stream.addEventListener("open", function () {
+        streamDelay = STREAM_RETRY_MS;
+        // Anything sent while disconnected is fetched from the history
+        const chat = openChat();
+        if (chat && chat.hiveLoadNewer) chat.hiveLoadNewer();
+    });
+    stream.addEventListener("error", function () {
+        // EventSource reconnects by itself unless the response was refused
+        if (stream.readyState !== EventSource.CLOSED || messageStream !== stream) return;
+        messageStream = null;
+        streamRetry = setTimeout(function () {
+            streamRetry = null;
+            syncMessageStream();
+        }, streamDelay * (0.5 + Math.random()));
+        streamDelay = Math.min(streamDelay * 2, STREAM_RETRY_MAX_MS);
+    });
+    stream.addEventListener("unread", function (e) {
+        showUnread(JSON.parse(e.data).unread);
+    });
+    stream.addEventListener("message", function (e) {
+        const data = JSON.parse(e.data);
+        const chat = openChat();
+        if (chat && chat.hiveLoadNewer && Number(chat.dataset.partnerId) === data.partner_id) {
+            // Fetching it marks it read, which the next event reflects
+            chat.hiveLoadNewer();
+        }
+        showUnread(data.unread);
+    });
+}
+
+document.addEventListener("hive:page", syncMessageStream);
+
+document.addEventListener("visibilitychange", function () {
+    const chat = document.querySelector(".chat[data-history-url]");
+    if (!document.hidden && chat && chat.hiveLoadNewer) chat.hiveLoadNewer();
+});
+
+document.addEventListener("DOMContentLoaded", function () {
+    reportNavigationTime();
+    initChat();
+    syncMessageStream();
+
+    // Slide-in animation for page (on refresh / direct open)
+    const page = document.querySelector(".page");
+    if (page) {
+        requestAnimationFrame(function () {
+            page.classList.add("page-slide-in");
+        });
+    }
+
+    // Route prefixes come from the server, see the data-* attributes on <body>
+    const settingsUrl = document.body.dataset.settingsUrl || "";
+    const profileUrl = document.body.dataset.profileUrl || "";
+
+    const overlay = document.getElementById("route-overlay");
+    const labelEl = document.getElementById("route-overlay-label");
+    const titleEl = document.getElementById("route-overlay-title");
+
+    function showOverlay(text) {
+        if (!overlay) return;
+        if (labelEl) {
+            labelEl.textContent = text || "Loading...";
+        }
+        if (titleEl) {
+            titleEl.textContent = "3JMCO HIVE";
+        }
+        overlay.classList.add("show");
+    }
+
+    function hideOverlay() {
+        if (overlay) overlay.classList.remove("show");
+    }
+
+    const pageBody = document.getElementById("page-body");
+    const messagesEl = document.querySelector(".messages");
+    const navLinks = document.querySelectorAll(".nav a[data-tab]");
+
+    function showFlashes(flashes) {
+        if (!messagesEl) return;
+        messagesEl.textContent = "";
+        flashes.forEach(function (flash) {
+            const div = document.createElement("div");
+            div.className = flash[0] === "error" ? "msg error" : "msg";
+            div.textContent = flash[1];
+            messagesEl.appendChild(div);
+        });
+    }
+
+    function swapBody(data) {
+        pageBody.innerHTML = data.html;
+        navLinks.forEach(function (a) {
+            a.classList.toggle("active", a.dataset.tab === data.tab);
+        });
+        showFlashes(data.flashes || []);
+        window.scrollTo(0, 0);
+        document.dispatchEvent(new CustomEvent("hive:page"));
+    }
+
+    const prefetched = new Map();
+
+    function takePrefetched(url) {
+        const entry = prefetched.get(url);
+        prefetched.delete(url);
+        if (!entry || Date.now() - entry.at > PREFETCH_TTL_MS) return null;
+        return entry.promise;
+    }
+
+    function navigate(url, label, push) {
+        showOverlay(label);
+        const pending = takePrefetched(url);
+        const request = pending
+            ? pending.then(function (data) { return data || fetchFragment(url); })
+            : fetchFragment(url);
+
+        request.then(function (data) {
+            // Logging in or out changes the nav bar, so reload the whole page
+            if (String(data.user_id || "") !== (document.body.dataset.userId || "")) {
+                window.location = data.url;
+                return;
+            }
+            swapBody(data);
+            if (push) {
+                history.pushState({ fragment: true }, "", data.url);
+            } else if (data.url !== window.location.href) {
+                history.replaceState({ fragment: true }, "", data.url);
+            }
+            hideOverlay();
+            reportNavigationTime();
+        }).catch(function () {
+            window.location = url;
+        });
+    }
+
+    function handleLinkClick(e) {
+        const a = e.currentTarget;
+        const href = a.getAttribute("href");
+
+        if (!href) return;
+
+        // Don't intercept external or new-tab links or anchors
+        const isExternal = href.startsWith("http") && !href.startsWith(window.location.origin);
+        if (isExternal || a.target === "_blank" || href.startsWith("#")) {
+            return;
+        }
+        if (e.ctrlKey || e.metaKey || e.shiftKey || e.button !== 0) {
+            return;
+        }
+
+        e.preventDefault();
+
+        let label = a.dataset.transitionLabel || "";
+
+        // If no custom label, decide by current page (leaving) or target (entering)
+        if (!label) {
+            const path = window.location.pathname || "";
+            if (path.startsWith("/settings")) {
+                label = "Going on...";
+            } else if (path.startsWith("/profile")) {
+                label = "Going to user...";
+            } else if (settingsUrl && href.startsWith(settingsUrl)) {
+                label = "Going on...";
+            } else if (profileUrl && href.startsWith(profileUrl)) {
+                // crude match for /profile/<id>
+                label = "Going to user...";
+            } else {
+                label = "Loading...";
+            }
+        }
+
+        // Start loading straight away; the overlay fades in meanwhile
+        try {
+            sessionStorage.setItem(NAV_START_KEY, String(Date.now()));
+        } catch (err) {
+            // Storage disabled: navigation still works, just isn't timed
+        }
+        // Links with side effects (e.g. logout) always get a full load
+        if (!pageBody || !window.fetch || a.dataset.prefetch === "false") {
+            showOverlay(label);
+            window.location = href;
+            return;
+        }
+        navigate(a.href, label, true);
+    }
+
+    function prefetch(a) {
+        // Links with side effects (e.g. logout) opt out
+        if (a.dataset.prefetch === "false" || !pageBody || !window.fetch) return;
+        const url = a.href;
+        if (!url || new URL(url).origin !== window.location.origin) {
+            return;
+        }
+        const entry = prefetched.get(url);
+        if (entry && Date.now() - entry.at <= PREFETCH_TTL_MS) {
+            return;
+        }
+        prefetched.set(url, {
+            at: Date.now(),
+            promise: fetchFragment(url).catch(function () { return null; }),
+        });
+    }
+
+    if (pageBody && window.fetch) {
+        history.replaceState({ fragment: true }, "", window.location.href);
+        window.addEventListener("popstate", function (e) {
+            if (e.state && e.state.fragment) {
+                navigate(window.location.href, "Loading...", false);
+            }
+        });
+    }
+
+    // Attach to all internal nav links we mark with data-transition="true"
+    const links = document.querySelectorAll("a[data-transition='true']");
+    links.forEach(function (a) {
+        let hoverTimer = null;
+        a.addEventListener("click", handleLinkClick);
+        a.addEventListener("mouseenter", function () {
+            hoverTimer = setTimeout(function () {
+                prefetch(a);
+            }, PREFETCH_HOVER_MS);
+        });
+        a.addEventListener("mouseleave", function () {
+            clearTimeout(hoverTimer);
+        });
+        a.addEventListener("touchstart", function () {
+            prefetch(a);
+        }, { passive: true });
+    });
+});